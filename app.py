@@ -1,14 +1,48 @@
 import streamlit as st
 import pandas as pd
 import random
+import math
+import time
+import pickle
+import tempfile
+import weakref
+import hashlib
+from collections import deque
 import urllib.parse
 import os
-import base64 # ★追加：画像を埋め込むためのライブラリ
-from rapidfuzz import fuzz
+import re
 from streamlit_mic_recorder import speech_to_text
+# データ読み込み・索引・検索・キャッシュなどStreamlitに依存しない処理
+from recipe_core import (
+    PerfMonitor, normalize_text, SnapshotStore, SnapshotDisk, SheetFetcher, load_data, password_digest,
+    form_response_url, AckQueue, LRUCache, QueryResultCache, ImageCache, DriveMirror,
+    print_html_head, generate_print_body, PRINT_HTML_TAIL,
+)
 
 # ページ設定
 st.set_page_config(page_title="Recipe Viewer", page_icon="img/favicon.ico", layout="wide")
+run_started = time.perf_counter()
+
+# --- 処理時間・件数の計測（プロセス全体で集計） ---
+@st.cache_resource
+def get_perf_monitor():
+    # 環境変数 RECIPE_APP_METRICS_LOG にパスを入れると計測結果をJSON Linesで追記する
+    return PerfMonitor(log_path=os.environ.get("RECIPE_APP_METRICS_LOG") or None)
+
+perf = get_perf_monitor()
+
+# --- 再実行時間の計測（セッションごとに直近50回を保持。プロセス全体の集計にも入れる） ---
+def record_rerun_time(label, started):
+    ms = (time.perf_counter() - started) * 1000
+    timings = st.session_state.setdefault("rerun_timings", {})
+    timings.setdefault(label, deque(maxlen=50)).append(ms)
+    perf.observe(f"再実行: {label}", ms)
+
+def rerun_time_report():
+    rows = []
+    for label, values in st.session_state.get("rerun_timings", {}).items():
+        rows.append({"範囲": label, "回数": len(values), "平均(ms)": round(sum(values) / len(values), 1), "直近(ms)": round(values[-1], 1)})
+    return pd.DataFrame(rows, columns=["範囲", "回数", "平均(ms)", "直近(ms)"])
 
 # ==========================================
 # 👇 設定エリア：URL設定完了済み
@@ -19,6 +53,9 @@ news_csv = "https://docs.google.com/spreadsheets/d/e/2PACX-1vQN7zOdMeK_lRCOzG8co
 store_csv = "https://docs.google.com/spreadsheets/d/e/2PACX-1vQN7zOdMeK_lRCOzG8coIdHkdawIbSvlLyhU5KpEHAbca75YCCT1gBwB85K2ah5gcr6Yd3rPessbNWN/pub?gid=285648220&single=true&output=csv"
 news_log_csv = "https://docs.google.com/spreadsheets/d/e/2PACX-1vQFXVfpeGAVHkjw65-GFPStuh1PSvteeVcckdAGYKhIOZ1YBX3HftRHgXxY-ozV_AWk1E-s4zP4lqYC/pub?output=csv"
 
+# ローカルキャッシュ（スナップショット等）の保存先
+CACHE_DIR = os.environ.get("RECIPE_APP_CACHE_DIR", ".cache")
+
 # フォーム設定
 news_form_url = "https://docs.google.com/forms/d/e/1FAIpQLSeLSyph6KJ3aPPgdCCxKuZ2tRLCZI13ftsM3-godUqzB1hOyg/viewform?usp=pp_url"
 news_entry_store = "entry.1108417758"
@@ -26,6 +63,8 @@ news_entry_title = "entry.1493447951"
 feedback_form_url = "https://docs.google.com/forms/d/e/1FAIpQLSegPgDFDG8h_cxV2Z7BcBkw3rZWjCUU9mCpIPqwwp_C-laXPQ/viewform?usp=pp_url"
 feedback_entry_store = "entry.1319375613"
 feedback_entry_recipe = "entry.973206102"
+# 意見本文の入力欄（設定するとアプリ内で意見を入力して送信できる。未設定ならフォームを開くリンクになる）
+feedback_entry_message = os.environ.get("RECIPE_APP_FEEDBACK_ENTRY_MESSAGE", "")
 
 # ==========================================
 
@@ -56,93 +95,77 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# --- データ読み込み関数 ---
-@st.cache_data(ttl=60)
-def load_data():
-    def convert_google_drive_url(url):
-        url = str(url).strip()
-        if "drive.google.com" in url and "/d/" in url:
-            try:
-                file_id = url.split("/d/")[1].split("/")[0]
-                return f"https://drive.google.com/uc?export=view&id={file_id}"
-            except IndexError: return url
-        return url
-
-    def clean_ingredients_list(raw_text):
-        names = []
-        if pd.isna(raw_text): return []
-        for line in str(raw_text).split('\n'):
-            parts = line.split('、')
-            if parts[0].strip():
-                names.append(parts[0].strip())
-        return names
-
-    try:
-        df_recipe = pd.read_csv(recipe_csv)
-        df_recipe.columns = df_recipe.columns.str.replace('\n', '').str.replace('\r', '').str.strip()
-        
-        df_recipe["ingredients_raw"] = df_recipe["ingredients"].fillna("") 
-        df_recipe["ingredients"] = df_recipe["ingredients_raw"].apply(clean_ingredients_list)
-        
-        if "target_stores" not in df_recipe.columns: df_recipe["target_stores"] = "共通"
-        if "image" in df_recipe.columns: df_recipe["image"] = df_recipe["image"].apply(convert_google_drive_url)
-        if "video" in df_recipe.columns:
-            df_recipe["video"] = df_recipe["video"].apply(lambda x: convert_google_drive_url(x) if "drive.google.com" in str(x) else x)
-        
-        for col in ["tableware", "cutlery", "caution"]:
-            if col not in df_recipe.columns:
-                df_recipe[col] = "-"
-        
-        df_recipe = df_recipe.fillna("-")
-    except: df_recipe = pd.DataFrame()
-
-    try:
-        df_ing = pd.read_csv(ingredient_csv)
-        df_ing.columns = df_ing.columns.str.replace('\n', '').str.replace('\r', '').str.strip()
-        df_ing = df_ing.fillna("-")
-        if "商品名" in df_ing.columns:
-            df_ing["商品名"] = df_ing["商品名"].astype(str).str.strip()
-            ing_dict = df_ing.set_index("商品名").to_dict(orient="index")
-        else: ing_dict = {}
-    except: ing_dict = {}
-
-    try:
-        df_news = pd.read_csv(news_csv)
-        df_news = df_news.fillna("")
-    except: df_news = pd.DataFrame()
-
-    try:
-        df_stores = pd.read_csv(store_csv, dtype=str)
-        df_stores = df_stores.fillna("")
-        if "store_code" in df_stores.columns: df_stores["store_code"] = df_stores["store_code"].str.strip()
-        if "password" in df_stores.columns: df_stores["password"] = df_stores["password"].str.strip()
-    except: df_stores = pd.DataFrame()
-
-    try:
-        df_log = pd.read_csv(news_log_csv)
-        df_log = df_log.fillna("")
-    except: df_log = pd.DataFrame()
-
-    return df_recipe, ing_dict, df_news, df_stores, df_log
-
-df, ingredient_dict, df_news, df_stores, df_log = load_data()
-
-
-# --- 材料文字列をパースして表データにする関数 ---
-def parse_ingredients_to_df(raw_text):
-    data = []
-    lines = str(raw_text).split('\n')
-    for line in lines:
-        parts = line.split('、')
-        if len(parts) >= 3:
-            data.append({"食材": parts[0], "使用量": parts[1], "備考": parts[2]})
-        elif len(parts) == 2:
-            data.append({"食材": parts[0], "使用量": parts[1], "備考": ""})
-        elif len(parts) == 1 and parts[0].strip():
-            data.append({"食材": parts[0], "使用量": "", "備考": ""})
-    if not data:
-        return pd.DataFrame(columns=["食材", "使用量", "備考"])
-    return pd.DataFrame(data)
+# --- スナップショットを参照する補助関数 ---
+def get_recipe_ingredients(snap, recipe_id):
+    # 行と食材表は同じスナップショットから取る（別の版を混ぜると位置がずれる）
+    start, stop = snap.ing_spans.get(recipe_id, (0, 0))
+    return snap.ing_table.iloc[start:stop]
+
+def session_memory_bytes():
+    # このセッションが個別に保持している状態（session_state）のpickle後サイズ
+    total = 0
+    for value in st.session_state.to_dict().values():
+        try: total += len(pickle.dumps(value))
+        except Exception: pass
+    return total
+
+
+# --- スプレッドシート（CSV公開）の取得 ---
+SOURCES = {"recipe": recipe_csv, "ingredient": ingredient_csv, "news": news_csv, "store": store_csv, "news_log": news_log_csv}
+
+@st.cache_resource
+def get_snapshot_store():
+    fetcher = SheetFetcher(SOURCES)
+    store = SnapshotStore(lambda previous: load_data(fetcher, previous, perf), ttl=60, disk=SnapshotDisk(os.path.join(CACHE_DIR, "snapshot")))
+    store.fetcher = fetcher
+    return store
+
+snapshot_store = get_snapshot_store()
+snapshot = snapshot_store.get()
+# ここで取り出すのは全体の再実行で使うものだけ。フラグメントは実行のたびにsnapshot_store.get()で取り直す
+df, df_stores, facets, unresolved_report = snapshot.df, snapshot.df_stores, snapshot.facets, snapshot.unresolved_report
+
+
+# --- 既読・意見の送信キュー ---
+@st.cache_resource
+def get_ack_queue():
+    return AckQueue(os.path.join(CACHE_DIR, "acks.sqlite3"), {
+        "read": (form_response_url(news_form_url), {"store": news_entry_store, "title": news_entry_title}),
+        "feedback": (form_response_url(feedback_form_url), {"store": feedback_entry_store, "title": feedback_entry_recipe, "message": feedback_entry_message}),
+    })
+
+ack_queue = get_ack_queue()
+
+
+# --- 画像のサイズ別キャッシュ / Google Drive上の画像・動画のミラー ---
+@st.cache_resource
+def get_image_cache():
+    return ImageCache(os.path.join(CACHE_DIR, "images"))
+
+image_cache = get_image_cache()
+
+@st.cache_resource
+def get_drive_mirror():
+    return DriveMirror(os.path.join(CACHE_DIR, "mirror"))
+
+drive_mirror = get_drive_mirror()
+drive_mirror.sync(snapshot)
+
+
+def image_source(img_src, variant):
+    # st.imageに渡す画像。ローカル/ミラー済みの画像は用途に合わせて縮小したものを使う
+    if img_src.startswith("http"):
+        local = drive_mirror.local_path(img_src)
+        return image_cache.variant(local, variant) if local else img_src
+    return image_cache.variant(img_src, variant)
+
+def prefetch_image(img_src, variant):
+    # 次に表示する画像を先に用意する（Driveはミラーの取得予約、ローカル/ミラー済みは縮小版の作成）
+    img_src = str(img_src).strip()
+    if img_src.startswith("http"):
+        local = drive_mirror.local_path(img_src)
+        if local: image_cache.prefetch(local, variant)
+    elif img_src and os.path.exists(img_src): image_cache.prefetch(img_src, variant)
 
 
 # --- ★画像をBase64エンコードする関数（HTML埋め込み用）★ ---
@@ -151,118 +174,108 @@ def get_image_base64(image_path):
     if not image_path or image_path == "-" or image_path == "nan":
         return ""
     
-    # URLの場合はそのまま返す（インターネット経由で表示されるため）
+    # URLの場合、ミラー済みなら埋め込み、まだならそのまま返す（インターネット経由で表示されるため）
     if str(image_path).startswith("http"):
-        return image_path
+        local = drive_mirror.local_path(image_path)
+        if local is None: return image_path
+        image_path = local
     
-    # ローカルファイルの場合、Base64文字列に変換して埋め込む
+    # ローカルファイルの場合、印刷用に縮小した画像をBase64文字列にして埋め込む
     if os.path.exists(image_path):
-        try:
-            with open(image_path, "rb") as img_file:
-                # バイナリをBase64に変換
-                b64_string = base64.b64encode(img_file.read()).decode()
-                # 拡張子に応じたMIMEタイプ（簡易判定）
-                mime = "image/png" if image_path.endswith(".png") else "image/jpeg"
-                return f"data:{mime};base64,{b64_string}"
+        try: return image_cache.data_uri(image_path, "print")
         except Exception:
             return "" # エラー時は画像なし
     return ""
 
 
-# --- 印刷用HTML生成関数 ---
-def generate_print_html(row, ing_df):
-    ing_rows = ""
-    for _, item in ing_df.iterrows():
-        ing_rows += f"<tr><td>{item['食材']}</td><td>{item['使用量']}</td><td>{item['備考']}</td></tr>"
-
-    steps_html = str(row["steps"]).replace("\n", "<br>")
-    tableware_html = str(row["tableware"]).replace("\n", "<br>")
-    cutlery_html = str(row["cutlery"]).replace("\n", "<br>")
-    caution_html = str(row["caution"]).replace("\n", "<br>")
-    
-    # ★画像を埋め込み形式に変換★
-    img_src = get_image_base64(str(row['image']).strip())
-    
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <title>{row['title']}</title>
-        <style>
-            body {{ font-family: sans-serif; padding: 20px; color: #000; }}
-            .header-table {{ width: 100%; border-collapse: collapse; margin-bottom: 10px; }}
-            .header-table th, .header-table td {{ border: 2px solid #000; padding: 8px; text-align: center; }}
-            .header-table th {{ background-color: #eee; font-weight: bold; width: 15%; }}
-            .title {{ font-size: 24px; font-weight: bold; text-align: center; }}
-            .main-container {{ display: flex; gap: 10px; border: 2px solid #000; }}
-            .left-col {{ flex: 1; padding: 10px; border-right: 2px solid #000; text-align: center; }}
-            .right-col {{ flex: 1; display: flex; flex-direction: column; }}
-            .info-row {{ border-bottom: 2px solid #000; padding: 5px; min-height: 50px; }}
-            .info-row:last-child {{ border-bottom: none; }}
-            .info-label {{ font-weight: bold; display: block; margin-bottom: 5px; font-size: 0.9em; }}
-            .ing-table {{ width: 100%; border-collapse: collapse; margin-top: 10px; font-size: 0.9em; }}
-            .ing-table th, .ing-table td {{ border: 1px solid #000; padding: 6px; }}
-            .ing-table th {{ background-color: #eee; text-align: center; }}
-            .steps-box {{ border: 2px solid #000; border-top: none; padding: 15px; }}
-            @media print {{ body {{ padding: 0; }} }}
-        </style>
-    </head>
-    <body>
-        <table class="header-table">
-            <tr>
-                <td class="title" colspan="4">{row['title']}</td>
-                <th>調理時間</th>
-                <td>{row['time']}</td>
-            </tr>
-        </table>
-        <div class="main-container">
-            <div class="left-col">
-                <img src="{img_src}" style="max-width:100%; max-height:300px; object-fit:contain;">
-            </div>
-            <div class="right-col">
-                <div class="info-row"><span class="info-label">使用食器</span>{tableware_html}</div>
-                <div class="info-row"><span class="info-label">カトラリー/コンディメント</span>{cutlery_html}</div>
-                <div class="info-row" style="flex:1;"><span class="info-label">詳細・注意事項</span><span style="color:red;">{caution_html}</span></div>
-            </div>
-        </div>
-        <table class="ing-table">
-            <thead><tr><th>食材</th><th>使用量</th><th>備考</th></tr></thead>
-            <tbody>{ing_rows}</tbody>
-        </table>
-        <div class="steps-box"><b>手順：</b><br>{steps_html}</div>
-        <script>window.onload=function(){{window.print();}}</script>
-    </body>
-    </html>
-    """
-    return html
+# --- 印刷用HTML（本文はレシピの内容ごとにキャッシュ） ---
+@st.cache_resource
+def get_print_cache():
+    # 印刷用の本文はレシピの内容ハッシュごとに全セッションで共有する（画像を埋め込むので合計サイズで上限）
+    return LRUCache(max_bytes=64 * 1024 * 1024)
+
+print_cache = get_print_cache()
+
+def recipe_print_body(row, snap):
+    # 内容（表示する列・食材行・埋め込む画像）が同じなら、前に作った本文を使い回す
+    ing_df = get_recipe_ingredients(snap, row.name)
+    image_path = str(row['image']).strip()
+    resolved = drive_mirror.local_path(image_path) if image_path.startswith("http") else image_path
+    stamp = os.path.getmtime(resolved) if resolved and os.path.exists(resolved) else None
+    parts = [str(row[c]) for c in ["title", "time", "tableware", "cutlery", "caution", "steps"]]
+    parts += [image_path, str(resolved), str(stamp)]
+    parts += ["\x1e".join(values) for values in zip(ing_df["食材"], ing_df["使用量"], ing_df["備考"])]
+    key = hashlib.sha1("\x1f".join(parts).encode()).hexdigest()
+    body = print_cache.get(key)
+    if body is None:
+        with perf.span("印刷: HTML生成"):
+            # ★画像を埋め込み形式に変換★
+            img_src = get_image_base64(image_path)
+            body = print_cache.put(key, generate_print_body(row, ing_df, img_src))
+    return body
+
+def recipe_print_html(row, snap):
+    # 詳細画面の🖨️ボタンを押したときにだけ呼ばれる
+    return print_html_head(row['title']) + recipe_print_body(row, snap) + PRINT_HTML_TAIL
+
+def iter_bulk_print_html(title, rows, snap):
+    # 複数レシピを1ファイルにまとめた印刷用HTMLを、レシピ1件ずつ順に組み立てる
+    yield print_html_head(title)
+    for _, row in rows.iterrows():
+        yield f'\n        <section class="recipe-page">{recipe_print_body(row, snap)}\n        </section>'
+    yield PRINT_HTML_TAIL
+
+def remove_quietly(path):
+    try: os.remove(path)
+    except OSError: pass
+
+def bulk_print_file(title, rows, snap):
+    # 全件を一度に文字列にせず、一時ファイルへ書き足してから読み取り用に開き直して渡す
+    # （download_buttonが受け付けるのは読み取り専用のファイル(BufferedReader)）
+    with tempfile.NamedTemporaryFile(dir=CACHE_DIR, suffix=".html", delete=False) as f:
+        path = f.name
+        try:
+            with perf.span("印刷: まとめて出力", 件数=len(rows)):
+                for chunk in iter_bulk_print_html(title, rows, snap): f.write(chunk.encode("utf-8"))
+        except Exception:
+            f.close()
+            remove_quietly(path)
+            raise
+    reader = open(path, "rb")
+    # 開いたままでも消せるOSではすぐ消す。消せない場合（Windows）は読み終わったファイルが閉じられたときに消す
+    try: os.remove(path)
+    except OSError: weakref.finalize(reader, remove_quietly, path)
+    return reader
 
 # --- 全画面表示用ダイアログ ---
 @st.dialog("レシピ詳細", width="large")
-def show_recipe_modal(row, ing_dict):
+def show_recipe_modal(row, snap):
+    started = time.perf_counter()
     col_header, col_print = st.columns([8, 1])
     with col_header: st.header(row["title"])
     
-    ing_df = parse_ingredients_to_df(row["ingredients_raw"])
+    ing_df = get_recipe_ingredients(snap, row.name)
 
     with col_print:
-        html_data = generate_print_html(row, ing_df)
-        st.download_button(label="🖨️", data=html_data, file_name=f"{row['title']}.html", mime="text/html", help="印刷用ファイルをダウンロード")
+        # 印刷用HTMLはボタンが押されたときに作る（作ったものはレシピの内容ごとにキャッシュ）
+        st.download_button(label="🖨️", data=lambda: recipe_print_html(row, snap), file_name=f"{row['title']}.html", mime="text/html", help="印刷用ファイルをダウンロード")
     
     # 画像表示（安全装置付き）
     img_src = str(row["image"]).strip()
     if img_src and img_src != "-" and img_src != "nan":
         if img_src.startswith("http"):
-            st.image(img_src, use_container_width=True)
+            st.image(image_source(img_src, "modal"), use_container_width=True)
         else:
             if os.path.exists(img_src):
-                st.image(img_src, use_container_width=True)
+                st.image(image_source(img_src, "modal"), use_container_width=True)
             else:
                 st.warning(f"画像が見つかりません: {img_src}")
     
     if "video" in row and str(row["video"]).startswith("http"):
-        with st.expander("🎥 調理動画を見る", expanded=False):
-            st.video(row["video"])
+        # expanderは閉じていても中身が実行され、ミラー済みの動画（最大200MB）を毎回メディア置き場へ読み込んでしまうので、
+        # 見ると選んだときだけst.videoを呼ぶ
+        if st.toggle("🎥 調理動画を見る", key=f"video_{row.name}"):
+            st.video(drive_mirror.local_path(row["video"]) or row["video"])
 
     c1, c2 = st.columns([1.2, 1])
     with c1:
@@ -285,15 +298,10 @@ def show_recipe_modal(row, ing_dict):
     
     with c3:
         st.subheader("🛒 食材・分量")
-        for _, item in ing_df.iterrows():
-            name = item['食材']
+        for name, amount, note, master_key in zip(ing_df["食材"], ing_df["使用量"], ing_df["備考"], ing_df["master_key"]):
             cols = st.columns([2, 1, 2])
             
-            matched_info = None
-            if name in ingredient_dict: matched_info = ingredient_dict[name]
-            else:
-                for k, info in ingredient_dict.items():
-                    if name in k: matched_info = info; break
+            matched_info = snap.ingredient_dict.get(master_key)
             
             with cols[0]:
                 if matched_info:
@@ -305,8 +313,8 @@ def show_recipe_modal(row, ing_dict):
                         st.markdown(f"**期限(開封後)**: {matched_info.get('開封後賞味期限目安', '-')}")
                 else:
                     st.write(name)
-            with cols[1]: st.write(item['使用量'])
-            with cols[2]: st.caption(item['備考'])
+            with cols[1]: st.write(amount)
+            with cols[2]: st.caption(note)
             st.markdown("<hr style='margin: 0.2rem 0; border-top: 1px solid #eee;'>", unsafe_allow_html=True)
 
     with c4:
@@ -314,16 +322,94 @@ def show_recipe_modal(row, ing_dict):
         st.markdown(str(row["steps"]).replace("\n", "  \n"))
 
     st.divider()
-    store_enc = urllib.parse.quote(str(st.session_state.store_name))
-    recipe_enc = urllib.parse.quote(str(row['title']))
-    fb_link = f"{feedback_form_url}&{feedback_entry_store}={store_enc}&{feedback_entry_recipe}={recipe_enc}"
-    st.link_button("💬 このレシピへ意見を送る", fb_link, use_container_width=True)
+    render_feedback(row, "modal", use_container_width=True)
+    record_rerun_time("レシピ詳細", started)
+
+
+# --- レシピへの意見 ---
+def render_feedback(row, key_prefix, use_container_width=False):
+    if not feedback_entry_message:
+        store_enc = urllib.parse.quote(str(st.session_state.store_name))
+        recipe_enc = urllib.parse.quote(str(row['title']))
+        fb_link = f"{feedback_form_url}&{feedback_entry_store}={store_enc}&{feedback_entry_recipe}={recipe_enc}"
+        st.link_button("💬 このレシピへ意見を送る", fb_link, use_container_width=use_container_width)
+        return
+
+    def send(message_key):
+        message = st.session_state.get(message_key, "").strip()
+        if message:
+            ack_queue.record_feedback(st.session_state.store_name, row['title'], message)
+            st.session_state[message_key] = ""
+            st.toast("💬 意見を受け付けました")
+
+    with st.popover("💬 このレシピへ意見を送る", use_container_width=use_container_width):
+        message_key = f"feedback_{key_prefix}_{row.name}"
+        st.text_area("意見", key=message_key, placeholder="気づいたことを入力してください")
+        st.button("送信", key=f"{message_key}_send", on_click=send, args=(message_key,), type="primary")
+
+
+# --- 検索結果カード ---
+def render_recipe_details(row, snap):
+    ing_df_simple = get_recipe_ingredients(snap, row.name)
+    for name, amount, note, master_key in zip(ing_df_simple["食材"], ing_df_simple["使用量"], ing_df_simple["備考"], ing_df_simple["master_key"]):
+        cols_exp = st.columns([2, 1, 2])
+        matched_info = snap.ingredient_dict.get(master_key)
+        with cols_exp[0]:
+            if matched_info:
+                with st.popover(f"ℹ️ {name}", use_container_width=True):
+                    st.markdown(f"**{matched_info.get('商品名', name)}**")
+                    st.caption(f"商品コード: {matched_info.get('商品コード', '-')}")
+                    st.markdown(f"**賞味期限**: {matched_info.get('賞味期限', '-')}")
+                    st.markdown(f"**保管(開封後)**: {matched_info.get('開封後温度帯', '-')}")
+                    st.markdown(f"**期限(開封後)**: {matched_info.get('開封後賞味期限目安', '-')}")
+            else: st.write(name)
+        with cols_exp[1]: st.write(amount)
+        with cols_exp[2]: st.caption(note)
+        st.markdown("<hr style='margin: 0.2rem 0; border-top: 1px solid #eee;'>", unsafe_allow_html=True)
+
+    st.markdown("**📝 作り方**")
+    st.markdown(str(row["steps"]).replace("\n", "  \n"))
+    st.divider()
+    render_feedback(row, "card")
+
+def render_recipe_card(row, snap):
+    perf.count("描画: レシピカード")
+    with st.container(border=True):
+        # 画像表示（安全装置付き）
+        img_src = str(row["image"]).strip()
+        if img_src and img_src != "-" and img_src != "nan":
+            if img_src.startswith("http"):
+                st.image(image_source(img_src, "card"), use_container_width=True)
+            else:
+                if os.path.exists(img_src):
+                    st.image(image_source(img_src, "card"), use_container_width=True)
+                else:
+                    st.warning(f"Not Found: {img_src}")
+
+        if st.button(f"🔍 {row['title']}", key=f"btn_{row.name}", use_container_width=True):
+            show_recipe_modal(row, snap)
+        st.caption(f"🏢 {row['target_stores']} | 📂 {row['category']} | ⏱ {row['time']}")
+        # 詳細は開いたときだけ組み立てる（閉じているカードはウィジェットを出さない）
+        if st.toggle("詳細", key=f"detail_{row.name}"):
+            with st.container(border=True):
+                perf.count("描画: カードの詳細")
+                render_recipe_details(row, snap)
+
+def render_pager(page, n_pages):
+    def move(step):
+        st.session_state.result_page = min(max(page + step, 0), n_pages - 1)
+
+    col_prev, col_info, col_next = st.columns([1, 2, 1])
+    with col_prev: st.button("◀ 前へ", on_click=move, args=(-1,), disabled=page == 0, use_container_width=True)
+    with col_info: st.markdown(f"<p style='text-align:center;'>{page + 1} / {n_pages} ページ</p>", unsafe_allow_html=True)
+    with col_next: st.button("次へ ▶", on_click=move, args=(1,), disabled=page >= n_pages - 1, use_container_width=True)
 
 
 # --- ログイン機能 ---
 if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
     st.session_state.store_name = ""
+    st.session_state.is_admin = False
 
 if not st.session_state.logged_in:
     st.markdown("### 🔑 Login")
@@ -332,38 +418,40 @@ if not st.session_state.logged_in:
     input_password = st.text_input("パスワード", type="password")
     if st.button("ログイン"):
         if not df_stores.empty:
-            match = df_stores[(df_stores["store_code"] == input_code) & (df_stores["password"] == input_password)]
+            # 店舗シートのパスワードは読み込み時にハッシュにしてある（recipe_core.prepare_stores）
+            match = df_stores[(df_stores["store_code"] == input_code) & (df_stores["password_hash"] == password_digest(input_code, input_password))]
             if not match.empty:
                 st.session_state.logged_in = True
                 st.session_state.store_name = match.iloc[0]["store_name"]
+                # 店舗シートのrole列が「admin」「管理者」のアカウントには管理用の表示を出す
+                st.session_state.is_admin = str(match.iloc[0].get("role", "")).strip().lower() in ("admin", "管理者")
                 st.rerun()
             else: st.error("違います")
         else:
             if input_password == "secret123":
                  st.session_state.logged_in = True
                  st.session_state.store_name = "管理者(緊急)"
+                 st.session_state.is_admin = True
                  st.rerun()
             else: st.error("エラー")
     st.stop()
 
 # --- レイアウト ---
 st.sidebar.title(f"👤 {st.session_state.store_name}")
-mode = st.sidebar.radio("メニュー", ["🏠 ホーム", "🔍 レシピ検索", "🎓 検定"])
+mode = st.sidebar.radio("メニュー", ["🏠 ホーム", "🔍 レシピ検索", "🎓 検定", "🚫 欠品影響"])
 st.sidebar.divider()
 
 # --- 🏠 ホーム ---
-if mode == "🏠 ホーム":
-    st.title("📢 お知らせ")
+@st.fragment
+def news_fragment():
+    started = time.perf_counter()
+    # フラグメントだけの再実行ではモジュールの変数が更新されないので、最新のスナップショットを取り直す
+    snap = snapshot_store.get()
+    df_news, read_index = snap.df_news, snap.read_index
     if df_news.empty: st.info("現在、お知らせはありません。")
     else:
-        if "date" in df_news.columns:
-            try: df_news["date"] = pd.to_datetime(df_news["date"], errors='coerce'); df_news = df_news.sort_values("date", ascending=False)
-            except: pass
-
-        my_read_titles = []
-        if not df_log.empty:
-            my_logs = df_log[df_log["店舗名"] == st.session_state.store_name]
-            my_read_titles = my_logs["確認した記事"].unique().tolist()
+        # df_newsは読み込み時に新しい順へ並べ替え済み
+        my_read_titles = read_index.read_titles(st.session_state.store_name) | ack_queue.read_titles(st.session_state.store_name)
 
         unread_news = []
         read_news = []
@@ -388,10 +476,8 @@ if mode == "🏠 ホーム":
                         st.write(row.get('content', ''))
                     with col2:
                         st.write("") 
-                        store_enc = urllib.parse.quote(str(st.session_state.store_name))
-                        title_enc = urllib.parse.quote(str(row.get('title', '')))
-                        link = f"{news_form_url}&{news_entry_store}={store_enc}&{news_entry_title}={title_enc}"
-                        st.link_button("✅ 既読", link, type="primary")
+                        # 既読はローカルに記録してすぐ反映し、フォームへはバックグラウンドで送る
+                        st.button("✅ 既読", key=f"read_{row.name}", type="primary", on_click=ack_queue.record_read, args=(st.session_state.store_name, row.get('title', '')))
 
         if read_news:
             st.divider()
@@ -401,19 +487,23 @@ if mode == "🏠 ホーム":
                     st.caption(f"📅 {row.get('date', '')}")
                     st.write(row.get('content', ''))
                     st.divider()
+    record_rerun_time("お知らせ", started)
 
 # --- 🔍 レシピ検索 ---
-elif mode == "🔍 レシピ検索":
-    st.title("🔍 Recipe Search")
-    
+def clear_search():
+    st.session_state.search_query = ""
+
+@st.fragment
+def search_fragment(selected_store, selected_category, page_size):
+    # 入力・✖・音声入力はこの範囲だけを再実行する
+    started = time.perf_counter()
+    snap = snapshot_store.get()
+    df = snap.df
     if 'search_query' not in st.session_state:
         st.session_state.search_query = ""
     if 'last_voice_text' not in st.session_state:
         st.session_state.last_voice_text = None
 
-    def clear_search():
-        st.session_state.search_query = ""
-
     with st.container(border=True):
         col_mic, col_text, col_clear = st.columns([1, 6, 0.7], gap="small")
         with col_mic:
@@ -427,122 +517,227 @@ elif mode == "🔍 レシピ検索":
             st.button("✖", on_click=clear_search, help="検索ワードを削除", use_container_width=True)
 
     if not df.empty:
-        all_stores = set()
-        for stores in df["target_stores"]:
-            for store in str(stores).split("、"):
-                if store.strip(): all_stores.add(store.strip())
-        store_options = ["すべて"] + sorted(list(all_stores))
-        selected_store = st.sidebar.selectbox("業態", store_options)
-    else: selected_store = "すべて"
-    if not df.empty and "category" in df.columns:
-        categories = ["すべて"] + list(df["category"].unique())
-        selected_category = st.sidebar.selectbox("カテゴリ", categories)
-    else: selected_category = "すべて"
-
-    if not df.empty:
-        filtered_df = df.copy()
-        if selected_store != "すべて":
-            filtered_df = filtered_df[filtered_df["target_stores"].astype(str).apply(lambda x: selected_store in x)]
-        if selected_category != "すべて":
-            filtered_df = filtered_df[filtered_df["category"] == selected_category]
-        if search_query:
-            def get_fuzzy_score(row):
-                q = search_query.lower()
-                title = str(row['title']).lower()
-                ingredients = " ".join(row['ingredients']) if isinstance(row['ingredients'], list) else str(row['ingredients'])
-                ingredients = ingredients.lower()
-                title_score = fuzz.partial_ratio(q, title)
-                ing_score = fuzz.partial_ratio(q, ingredients)
-                return max(title_score * 1.1, ing_score)
-            filtered_df['match_score'] = filtered_df.apply(get_fuzzy_score, axis=1)
-            filtered_df = filtered_df[filtered_df['match_score'] > 60]
-            filtered_df = filtered_df.sort_values('match_score', ascending=False)
-
-        st.write(f"検索結果: {len(filtered_df)} 件")
-        if filtered_df.empty: st.info("見つかりませんでした")
+        positions = cached_search(snap, search_query, selected_store, selected_category)
+
+        # 条件が変わったら1ページ目に戻す
+        result_key = (search_query, selected_store, selected_category, page_size)
+        if st.session_state.get("result_key") != result_key:
+            st.session_state.result_key = result_key
+            st.session_state.result_page = 0
+        n_pages = max(1, math.ceil(len(positions) / page_size))
+        page = min(st.session_state.result_page, n_pages - 1)
+
+        st.write(f"検索結果: {len(positions)} 件")
+        if len(positions) == 0: st.info("見つかりませんでした")
         else:
+            # 表示中のページ分だけ描画する
+            page_df = df.iloc[positions[page * page_size:(page + 1) * page_size]]
             cols = st.columns(3)
-            for index, (i, row) in enumerate(filtered_df.iterrows()):
-                col = cols[index % 3]
-                with col:
-                    with st.container(border=True):
-                        # 画像表示（安全装置付き）
-                        img_src = str(row["image"]).strip()
-                        if img_src and img_src != "-" and img_src != "nan":
-                            if img_src.startswith("http"):
-                                st.image(img_src, use_container_width=True)
-                            else:
-                                if os.path.exists(img_src):
-                                    st.image(img_src, use_container_width=True)
-                                else:
-                                    st.warning(f"Not Found: {img_src}")
-
-                        if st.button(f"🔍 {row['title']}", key=f"btn_{index}", use_container_width=True):
-                            show_recipe_modal(row, ingredient_dict)
-                        st.caption(f"🏢 {row['target_stores']} | 📂 {row['category']} | ⏱ {row['time']}")
-                        with st.expander("詳細"):
-                            ing_df_simple = parse_ingredients_to_df(row["ingredients_raw"])
-                            for _, item in ing_df_simple.iterrows():
-                                name = item['食材']
-                                cols_exp = st.columns([2, 1, 2])
-                                matched_info = None
-                                if name in ingredient_dict: matched_info = ingredient_dict[name]
-                                else:
-                                    for k, info in ingredient_dict.items():
-                                        if name in k: matched_info = info; break
-                                with cols_exp[0]:
-                                    if matched_info:
-                                        with st.popover(f"ℹ️ {name}", use_container_width=True):
-                                            st.markdown(f"**{matched_info.get('商品名', name)}**")
-                                            st.caption(f"商品コード: {matched_info.get('商品コード', '-')}")
-                                            st.markdown(f"**賞味期限**: {matched_info.get('賞味期限', '-')}")
-                                            st.markdown(f"**保管(開封後)**: {matched_info.get('開封後温度帯', '-')}")
-                                            st.markdown(f"**期限(開封後)**: {matched_info.get('開封後賞味期限目安', '-')}")
-                                    else: st.write(name)
-                                with cols_exp[1]: st.write(item['使用量'])
-                                with cols_exp[2]: st.caption(item['備考'])
-                                st.markdown("<hr style='margin: 0.2rem 0; border-top: 1px solid #eee;'>", unsafe_allow_html=True)
-
-                            st.markdown("**📝 作り方**")
-                            st.markdown(str(row["steps"]).replace("\n", "  \n"))
-                            st.divider()
-                            store_enc = urllib.parse.quote(str(st.session_state.store_name))
-                            recipe_enc = urllib.parse.quote(str(row['title']))
-                            fb_link = f"{feedback_form_url}&{feedback_entry_store}={store_enc}&{feedback_entry_recipe}={recipe_enc}"
-                            st.link_button("💬 このレシピへ意見を送る", fb_link)
+            for index, (i, row) in enumerate(page_df.iterrows()):
+                with cols[index % 3]:
+                    render_recipe_card(row, snap)
+            if n_pages > 1:
+                render_pager(page, n_pages)
+    record_rerun_time("検索", started)
+
+@st.cache_resource
+def get_query_cache():
+    return QueryResultCache(max_items=512)
+
+query_cache = get_query_cache()
+
+def cached_search(snap, query, store, category):
+    # 同じ条件（正規化したキーワード・業態・カテゴリ）の検索結果は全セッションで共有する
+    key = (normalize_text(query), store, category, snap.version)
+    positions = query_cache.get(key)
+    if positions is None:
+        with perf.span("検索: 絞り込み+採点", query=key[0]) as info:
+            positions = snap.facets.filter(store, category)
+            info["filtered"] = len(positions)
+            if query: positions, _ = snap.search_engine.search(query, positions, stats=info)
+            info["hits"] = len(positions)
+        perf.count("検索: 採点した行数", info.get("scanned", 0))
+        positions.setflags(write=False)  # 共有するので書き換え禁止
+        query_cache.put(key, positions)
+    return positions
 
 # --- 🎓 レシピ検定 ---
+QUIZ_BATCH_SIZE = 10
+
+def refill_quiz_queue(snap):
+    # 問題はquiz_bankからまとめて作ってセッションに積んでおき、次の問題の画像は先に用意しておく
+    if st.session_state.get("quiz_version") != snap.version:
+        st.session_state.quiz_queue = deque()
+        st.session_state.quiz_version = snap.version
+    queue = st.session_state.quiz_queue
+    if len(queue) < 2: queue.extend(snap.quiz_bank.questions(random, QUIZ_BATCH_SIZE))
+    if queue: prefetch_image(snap.df.iloc[queue[0]["position"]]["image"], "modal")
+
+def generate_quiz():
+    # スタート時は積んである問題を取り出すだけ（ボタンを押した時点の最新のスナップショットで出題する）
+    snap = snapshot_store.get()
+    if not st.session_state.get("quiz_queue") or st.session_state.get("quiz_version") != snap.version: refill_quiz_queue(snap)
+    if not st.session_state.quiz_queue: return
+    q = st.session_state.quiz_queue.popleft()
+    st.session_state.current_quiz = {"data": snap.df.iloc[q["position"]], "options": q["options"], "correct_answer": q["correct_answer"]}
+    st.session_state.quiz_state = "answering"
+
+@st.fragment
+def quiz_fragment():
+    started = time.perf_counter()
+    if 'quiz_state' not in st.session_state: st.session_state.quiz_state = "start"
+    if 'current_quiz' not in st.session_state: st.session_state.current_quiz = None
+    col1, col2 = st.columns([2, 1])
+    with col2:
+        st.write("")
+        st.button("🔄 スタート", type="primary", on_click=generate_quiz)
+    if st.session_state.quiz_state == "answering" and st.session_state.current_quiz:
+        q = st.session_state.current_quiz
+        row = q["data"]
+        with col1:
+            st.markdown("### Q. この料理名は？")
+            if row["image"] and str(row["image"]).startswith("http"): st.image(image_source(row["image"], "modal"), width=400)
+            else:
+                st.info("📷 画像なし")
+                st.write("ヒント: " + str(row["ingredients_raw"]))
+            user_answer = st.radio("選択:", q["options"], key="quiz_radio")
+            if st.button("回答"):
+                if user_answer == q["correct_answer"]:
+                    st.balloons()
+                    st.success("🎉 正解！")
+                else: st.error(f"残念... 正解は「{q['correct_answer']}」")
+    # 表示が終わってから次の問題を補充する（スタートを押したときは取り出すだけで済む）
+    refill_quiz_queue(snapshot_store.get())
+    record_rerun_time("検定", started)
+
+# --- 🚫 欠品の影響調査 ---
+def split_sku_tokens(text):
+    # 改行・カンマ・タブ区切り（Excelからの貼り付け）を1件ずつに分ける
+    return [token for token in re.split(r"[\n\r\t,、]+", str(text)) if token.strip()]
+
+@st.fragment
+def stockout_fragment():
+    started = time.perf_counter()
+    snap = snapshot_store.get()
+    df, facets, usage_index = snap.df, snap.facets, snap.usage_index
+    sku_text = st.text_area("欠品した商品（商品コードまたは商品名を1行に1つ。カンマ・タブ区切りの貼り付けも可）", key="stockout_skus", height=160)
+    col_mode, col_store = st.columns(2)
+    with col_mode: match_mode = st.radio("条件", ["いずれかを使う", "すべてを使う"], horizontal=True, key="stockout_mode")
+    with col_store: store = st.selectbox("業態", facets.store_options, key="stockout_store")
+
+    keys, unknown = usage_index.resolve(split_sku_tokens(sku_text))
+    if unknown: st.warning(f"マスタにもレシピにも見つからない商品 ({len(unknown)}): " + "、".join(unknown[:50]) + (" ほか" if len(unknown) > 50 else ""))
+    if not keys:
+        st.info("商品を入力すると、その商品を使っているレシピを一覧にします。")
+        record_rerun_time("欠品影響", started)
+        return
+
+    scope = frozenset(df.index[facets.filter(store)]) if store != "すべて" else None
+    recipe_ids = usage_index.recipes_using(keys, require_all=match_mode == "すべてを使う")
+    if scope is not None: recipe_ids &= scope
+    usage = usage_index.usage(keys)
+    hits = df.loc[sorted(recipe_ids, key=lambda rid: (-len(usage[rid]), df.index.get_loc(rid)))]
+    result = pd.DataFrame({
+        "レシピ": hits["title"], "業態": hits["target_stores"], "カテゴリ": hits["category"],
+        "該当商品数": [len(usage[rid]) for rid in hits.index], "該当商品": ["、".join(usage[rid]) for rid in hits.index],
+    })
+
+    col_count, col_items = st.columns(2)
+    col_count.metric("影響のあるレシピ", f"{len(result)} 件")
+    col_items.metric("照会した商品", f"{len(keys)} 件")
+    if result.empty: st.success("該当するレシピはありません")
+    else:
+        st.dataframe(result, hide_index=True, use_container_width=True)
+        st.download_button("📥 CSVでダウンロード", data=result.to_csv(index=False).encode("utf-8-sig"), file_name="欠品影響レシピ.csv", mime="text/csv")
+
+    with st.expander("商品ごとの使用レシピ数"):
+        summary = pd.DataFrame({
+            "商品": keys,
+            "商品コード": [snap.ingredient_dict.get(key, {}).get("商品コード", "（マスタ未登録）") for key in keys],
+            "使用レシピ数": [len(usage_index.recipes(key) if scope is None else usage_index.recipes(key) & scope) for key in keys],
+        })
+        st.dataframe(summary.sort_values("使用レシピ数", ascending=False), hide_index=True, use_container_width=True)
+    record_rerun_time("欠品影響", started)
+
+
+if mode == "🏠 ホーム":
+    st.title("📢 お知らせ")
+    news_fragment()
+
+elif mode == "🔍 レシピ検索":
+    st.title("🔍 Recipe Search")
+
+    if not df.empty:
+        selected_store = st.sidebar.selectbox("業態", facets.store_options)
+    else: selected_store = "すべて"
+    if not df.empty and facets.category_options:
+        selected_category = st.sidebar.selectbox("カテゴリ", facets.category_options)
+    else: selected_category = "すべて"
+    page_size = st.sidebar.selectbox("表示件数", [12, 24, 48, 96])
+    if not unresolved_report.empty:
+        with st.sidebar.expander(f"⚠️ マスタ未登録の食材 ({len(unresolved_report)})"):
+            st.dataframe(unresolved_report, hide_index=True, use_container_width=True)
+    if not df.empty:
+        with st.sidebar.expander("🖨️ まとめて印刷"):
+            # 選んでいる業態・カテゴリのレシピ全部を、1レシピ1ページの印刷用ファイルにする
+            bulk_rows = df.iloc[facets.filter(selected_store, selected_category)]
+            bulk_title = f"レシピ集（業態: {selected_store} / カテゴリ: {selected_category}）"
+            st.caption(f"{len(bulk_rows)} 件のレシピ")
+            st.download_button("📄 印刷用ファイルをダウンロード", data=lambda: bulk_print_file(bulk_title, bulk_rows, snapshot),
+                               file_name=f"{bulk_title}.html", mime="text/html", disabled=bulk_rows.empty, use_container_width=True)
+
+    search_fragment(selected_store, selected_category, page_size)
+
 elif mode == "🎓 検定":
     st.title("🎓 レシピ検定")
     if not df.empty and len(df) >= 4:
-        if 'quiz_state' not in st.session_state: st.session_state.quiz_state = "start"
-        if 'current_quiz' not in st.session_state: st.session_state.current_quiz = None
-        def generate_quiz():
-            correct_row = df.sample(1).iloc[0]
-            wrong_titles = df[df["title"] != correct_row["title"]]["title"].sample(3).tolist()
-            options = wrong_titles + [correct_row["title"]]
-            random.shuffle(options)
-            st.session_state.current_quiz = {"data": correct_row, "options": options, "correct_answer": correct_row["title"]}
-            st.session_state.quiz_state = "answering"
-        col1, col2 = st.columns([2, 1])
-        with col2:
-            st.write("")
-            if st.button("🔄 スタート", type="primary"):
-                generate_quiz()
-                st.rerun()
-        if st.session_state.quiz_state == "answering" and st.session_state.current_quiz:
-            q = st.session_state.current_quiz
-            row = q["data"]
-            with col1:
-                st.markdown("### Q. この料理名は？")
-                if row["image"] and str(row["image"]).startswith("http"): st.image(row["image"], width=400)
-                else:
-                    st.info("📷 画像なし")
-                    st.write("ヒント: " + str(row["ingredients_raw"]))
-                user_answer = st.radio("選択:", q["options"], key="quiz_radio")
-                if st.button("回答"):
-                    if user_answer == q["correct_answer"]:
-                        st.balloons()
-                        st.success("🎉 正解！")
-                    else: st.error(f"残念... 正解は「{q['correct_answer']}」")
+        quiz_fragment()
+    else: st.warning("データ不足")
+
+elif mode == "🚫 欠品影響":
+    st.title("🚫 欠品の影響レシピ")
+    if not df.empty: stockout_fragment()
     else: st.warning("データ不足")
+
+# --- 再実行時間（全体 / 各フラグメント） ---
+record_rerun_time("全体", run_started)
+# 管理者向けの計測パネル（店舗の端末には内部のエラーや更新履歴を見せない）
+if st.session_state.get("is_admin"):
+    with st.sidebar.expander("⏱ 再実行時間"):
+        st.caption("部分再実行（フラグメント）は全体の再実行を伴わない")
+        st.dataframe(rerun_time_report(), hide_index=True, use_container_width=True)
+    with st.sidebar.expander("🧠 メモリ使用量"):
+        # スナップショット全体をたどるので重い。折りたたみ中も本体は毎回実行されるため、押したときだけ測る
+        if st.button("計測する", key="measure_memory"):
+            shared_report = snapshot.memory_report()
+            st.caption(f"共有スナップショット v{snapshot.version}（プロセスで1つ）: {shared_report['サイズ(KB)'].sum() / 1024:.1f} MB")
+            st.caption(f"このセッション固有の状態: {session_memory_bytes() / 1024:.1f} KB")
+            st.dataframe(shared_report, hide_index=True, use_container_width=True)
+        print_stats = print_cache.stats()
+        st.caption(f"印刷用HTMLキャッシュ: {print_stats['件数']} 件 / {print_stats['サイズ(MB)']} MB（ヒット率 {print_stats['ヒット率']}）")
+    with st.sidebar.expander("📈 パフォーマンス（プロセス全体）"):
+        st.caption("処理ごとの所要時間（直近1000回）")
+        st.dataframe(perf.timing_report(), hide_index=True, use_container_width=True)
+        st.caption("件数")
+        st.dataframe(perf.counter_report(), hide_index=True, use_container_width=True)
+        st.caption(f"共有キャッシュ（検索結果は上限 {query_cache.max_items} 件）")
+        st.dataframe(pd.DataFrame([
+            {"キャッシュ": name, **cache.stats()}
+            for name, cache in [("検索結果", query_cache), ("印刷用HTML", print_cache), ("画像(Base64)", image_cache)]
+        ]), hide_index=True, use_container_width=True)
+        if perf.log_path: st.caption(f"計測ログ: {perf.log_path}")
+    with st.sidebar.expander("📡 データ取得状況"):
+        origin = "ディスク" if snapshot.origin == "disk" else "ネットワーク"
+        st.caption(f"スナップショット v{snapshot.version}（{origin}から {time.strftime('%H:%M:%S', time.localtime(snapshot.loaded_at))} 読込）")
+        if snapshot_store.last_error: st.warning(snapshot_store.last_error)
+        st.dataframe(snapshot_store.fetcher.status_report(), hide_index=True, use_container_width=True)
+        st.caption(f"フォーム送信待ち: {ack_queue.pending_count()} 件")
+        mirror_status = drive_mirror.status()
+        st.caption(f"Driveミラー: {mirror_status['件数']} 件 / {mirror_status['サイズ(MB)']} MB（取得待ち {mirror_status['取得待ち']} 件）")
+        if drive_mirror.last_error: st.caption(f"直近のミラー取得エラー: {drive_mirror.last_error}")
+        image_status = image_cache.disk_status()
+        st.caption(f"縮小画像: {image_status['件数']} 件 / {image_status['サイズ(MB)']} MB（上限 {image_cache.max_bytes // 1024 // 1024} MB）")
+        if ack_queue.last_error: st.caption(f"直近の送信エラー: {ack_queue.last_error}")
+        if snapshot_store.refresh_log:
+            st.caption("更新履歴（再処理した行数）")
+            st.dataframe(pd.DataFrame(list(snapshot_store.refresh_log)), hide_index=True, use_container_width=True)
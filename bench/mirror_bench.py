@@ -0,0 +1,138 @@
+# Google Driveの代わりにローカルのHTTPサーバーから画像・動画を配信して、DriveミラーとImageCacheを計測する（Streamlitは不要）
+# 並列取得・取得できないURLの扱い・合計サイズによる追い出し（ミラーと縮小画像の両方）を確かめる
+#
+#   python bench/mirror_bench.py                                    # 画像120枚 / ミラー上限20MB / 縮小画像上限5MB
+#   python bench/mirror_bench.py --images 300 --latency-ms 100 --mirror-mb 50
+import argparse
+import functools
+import hashlib
+import http.server
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from recipe_core import DriveMirror, ImageCache  # noqa: E402
+from run_bench import Bench  # noqa: E402
+
+CONTENT_TYPES = {".jpg": "image/jpeg", ".png": "image/png", ".mp4": "video/mp4", ".html": "text/html"}
+
+
+class DriveStandIn(http.server.BaseHTTPRequestHandler):
+    # Driveの uc?export=view&id=... と同じ形のURLで、directory内の「id.拡張子」のファイルを返す
+    # 存在しないidは404、.htmlはDriveのログイン・確認ページの代わり（画像ではないので取得失敗になる）
+    def __init__(self, *args, directory=None, latency=0.0, **kwargs):
+        self.directory, self.latency = directory, latency
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        file_id = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query).get("id", [""])[0]
+        name = next((n for n in os.listdir(self.directory) if os.path.splitext(n)[0] == file_id), None)
+        if name is None:
+            self.send_error(404)
+            return
+        with open(os.path.join(self.directory, name), "rb") as f: body = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES[os.path.splitext(name)[1]])
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args): pass
+
+
+def serve_drive(directory, latency=0.0):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(DriveStandIn, directory=directory, latency=latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def generate_media(directory, count, rng, video_kb=2048):
+    # 写真に近い大きさのJPEG（ノイズ入りで圧縮が効きすぎないように）と、中身がダミーの動画を1本
+    os.makedirs(directory, exist_ok=True)
+    np_rng = np.random.default_rng(rng.randint(0, 2 ** 31))
+    for i in range(count):
+        base = np_rng.integers(0, 256, size=(150, 200, 3), dtype=np.uint8)
+        Image.fromarray(base).resize((1600, 1200)).save(os.path.join(directory, f"img{i:04d}.jpg"), quality=85)
+    with open(os.path.join(directory, "video0.mp4"), "wb") as f: f.write(os.urandom(video_kb * 1024))
+    with open(os.path.join(directory, "login.html"), "wb") as f: f.write(b"<html>sign in</html>")
+    return [f"img{i:04d}" for i in range(count)]
+
+
+def dir_mb(directory):
+    return sum(os.path.getsize(os.path.join(directory, n)) for n in os.listdir(directory) if not n.endswith(".tmp")) / 1024 / 1024
+
+
+def wait_idle(mirror, timeout=300):
+    deadline = time.time() + timeout
+    while mirror.status()["取得待ち"] and time.time() < deadline: time.sleep(0.01)
+
+
+def run(args):
+    bench = Bench()
+    workdir = tempfile.mkdtemp(prefix="mirror-bench-")
+    rng = random.Random(args.seed)
+    drive_dir = os.path.join(workdir, "drive")
+    ids = bench.measure("データ生成（画像・動画）", lambda: generate_media(drive_dir, args.images, rng), items=args.images)
+    bench.note("配信元の合計", **{"サイズ(MB)": round(dir_mb(drive_dir), 1)})
+    server = serve_drive(drive_dir, args.latency_ms / 1000)
+    base = f"http://127.0.0.1:{server.server_address[1]}/uc?export=view&id="
+    urls = [base + file_id for file_id in ids]
+    broken = [base + "missing", base + "login"]
+
+    # --- ミラー ---
+    mirror = DriveMirror(os.path.join(workdir, "mirror"), hosts=("127.0.0.1",), max_bytes=args.mirror_mb * 1024 * 1024, workers=args.workers)
+    def mirror_all():
+        mirror.request(urls + [base + "video0"] + broken)
+        wait_idle(mirror)
+    bench.measure("ミラー: 初回取得（並列）", mirror_all, items=len(urls) + 1)
+    status = mirror.status()
+    bench.note("  └ ミラーの状況", 件数=status["件数"], **{"サイズ(MB)": status["サイズ(MB)"], "ディスク(MB)": round(dir_mb(mirror.directory), 1)})
+    assert dir_mb(mirror.directory) <= args.mirror_mb, "ミラーが上限を超えています"
+    assert all(mirror.local_path(url) is None for url in broken), "取得できないURLがミラーされています"
+    assert mirror.last_error, "取得失敗が記録されていません"
+    # 追い出されたURLはlocal_pathを呼ぶと取り直しになるので、残っているものだけを参照する
+    stems = {os.path.splitext(name)[0] for name in os.listdir(mirror.directory)}
+    present = [url for url in urls if hashlib.sha1(url.encode()).hexdigest() in stems]
+    local = [mirror.local_path(url) for url in present]
+    bench.measure("ミラー: 取得済みの参照", lambda: [mirror.local_path(url) for url in present], items=len(present), repeat=10)
+
+    # --- 縮小画像 ---
+    images = ImageCache(os.path.join(workdir, "images"), max_bytes=args.images_mb * 1024 * 1024)
+    variants = list(ImageCache.VARIANTS)
+    bench.measure("縮小画像: 作成", lambda: [images.variant(path, v) for path in local for v in variants], items=len(local) * len(variants))
+    bench.measure("縮小画像: 作成済み（直近の分）", lambda: [images.variant(path, "card") for path in local[-5:]], items=5, repeat=20)
+    bench.measure("印刷用Base64: 直近の分", lambda: [images.data_uri(path) for path in local[-5:]], items=5, repeat=20)
+    status = images.disk_status()
+    bench.note("  └ 縮小画像の状況", 件数=status["件数"], **{"サイズ(MB)": status["サイズ(MB)"], "ディスク(MB)": round(dir_mb(images.directory), 1)})
+    assert dir_mb(images.directory) <= args.images_mb, "縮小画像が上限を超えています"
+
+    server.shutdown()
+    if not args.keep: shutil.rmtree(workdir, ignore_errors=True)
+    return bench.report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Driveミラーと縮小画像キャッシュのベンチマーク（ローカルのDrive代わりのサーバーを使う）")
+    parser.add_argument("--images", type=int, default=120)
+    parser.add_argument("--mirror-mb", type=int, default=20)
+    parser.add_argument("--images-mb", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency-ms", type=int, default=20, help="1リクエストあたりの応答遅延（Driveの往復時間の代わり）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="一時ディレクトリを消さない")
+    args = parser.parse_args()
+
+    report = run(args)
+    with pd.option_context("display.max_rows", None, "display.max_columns", None, "display.width", 200):
+        print(report.fillna("").to_string(index=False))
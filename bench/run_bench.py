@@ -0,0 +1,212 @@
+# 合成データでデータ読み込み・検索・印刷などの各段階を計測する（Streamlitは不要）
+# CSVはローカルのHTTPサーバーから配信するので、条件付きGETを含めて本番と同じ経路で読み込む
+#
+#   python bench/run_bench.py                          # 10,000レシピ / 20,000商品 / 既読ログ100万行
+#   python bench/run_bench.py --recipes 1000 --log-rows 100000 --json before.json
+#   python bench/run_bench.py --json after.json --compare before.json   # 変更前後の比較
+import argparse
+import csv
+import functools
+import http.server
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from recipe_core import (  # noqa: E402
+    PerfMonitor, SheetFetcher, SnapshotDisk, QueryResultCache, load_data, ingredient_spans, generate_print_html, approx_size,
+)
+import synthetic  # noqa: E402
+
+
+class NoPruning:
+    # n-gramの絞り込みを外して全行を採点させる（比較用）
+    def candidates(self, query, positions=None): return None
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args): pass
+
+
+def serve(directory):
+    # 空いているポートでディレクトリを配信する（Last-Modifiedによる条件付きGETに対応）
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def rss_mb():
+    # 現在の常駐メモリ（Linuxは/proc、それ以外はピーク値で代用）
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+class Bench:
+    def __init__(self):
+        self.rows = []
+
+    def measure(self, stage, fn, items=1, repeat=1):
+        # fnをrepeat回呼び、合計時間・件/秒・1回あたりのp50/p95・メモリの増分を記録する
+        before = rss_mb()
+        durations = []
+        result = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = fn()
+            durations.append(time.perf_counter() - started)
+        total = sum(durations)
+        after = rss_mb()
+        self.rows.append({
+            "段階": stage, "件数": items * repeat, "秒": round(total, 3), "件/秒": round(items * repeat / total, 1) if total else None,
+            "p50(ms)": round(float(np.percentile(durations, 50)) * 1000, 2), "p95(ms)": round(float(np.percentile(durations, 95)) * 1000, 2),
+            "RSS(MB)": round(after, 1), "RSS増分(MB)": round(after - before, 1),
+        })
+        return result
+
+    def note(self, stage, **values):
+        self.rows.append({"段階": stage, **values})
+
+    def report(self):
+        return pd.DataFrame(self.rows)
+
+
+def touch_later(path, seconds=2):
+    # Last-Modifiedは秒単位なので、書き換えたファイルの更新時刻を確実に進める
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + seconds))
+
+
+def run(args):
+    bench = Bench()
+    workdir = args.data_dir or tempfile.mkdtemp(prefix="recipe-bench-")
+    rng = random.Random(args.seed)
+    paths = bench.measure("データ生成（CSV書き出し）", lambda: synthetic.generate(
+        workdir, args.recipes, args.skus, args.log_rows, seed=args.seed,
+    ), items=args.recipes + args.skus + args.log_rows)
+    server = serve(workdir)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    sources = {name: f"{base}/{os.path.basename(path)}" for name, path in paths.items()}
+
+    # --- 読み込み ---
+    perf = PerfMonitor()
+    fetcher = SheetFetcher(sources)
+    snapshot = bench.measure("読込: 初回（全シート）", lambda: load_data(fetcher, None, perf), items=args.recipes + args.skus + args.log_rows)
+    for _, row in perf.timing_report().iterrows(): bench.note(f"  └ {row['処理']}", 秒=round(row["最大(ms)"] / 1000, 3))
+    bench.note("スナップショットの大きさ（概算）", **{"サイズ(MB)": round(approx_size(snapshot) / 1024 / 1024, 1)})
+    same = bench.measure("読込: 変更なし（条件付きGET）", lambda: load_data(fetcher, snapshot, perf))
+    assert same is snapshot
+
+    recipes = pd.read_csv(paths["recipe"], dtype=str)
+    changed = rng.sample(range(len(recipes)), max(1, len(recipes) // 100))
+    recipes.loc[changed, "time"] = "99"
+    recipes.to_csv(paths["recipe"], index=False)
+    touch_later(paths["recipe"])
+    appended = max(1, args.log_rows // 100)
+    with open(paths["news_log"], "a", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(synthetic.log_rows(appended, [f"店舗{i:04d}" for i in range(10)], ["お知らせ0"], rng))
+    touch_later(paths["news_log"])
+    snapshot = bench.measure(f"読込: 差分（レシピ{len(changed)}行変更・ログ{appended}行追記）", lambda: load_data(fetcher, snapshot, perf), items=len(changed) + appended)
+    bench.note("  └ 再処理の内訳", **{"件数": json.dumps(snapshot.refresh_stats, ensure_ascii=False)})
+
+    # --- 検索 ---
+    words = [w for w in synthetic.FOODS + synthetic.DISHES]
+    queries = [rng.choice(words) for _ in range(args.queries)]
+    stores = snapshot.facets.store_options
+    engine, facets = snapshot.search_engine, snapshot.facets
+    conditions = [(q, rng.choice(stores), "すべて") for q in queries]
+    it = iter(conditions * 2)
+    def search_once():
+        q, store, category = next(it)
+        return engine.search(q, facets.filter(store, category))
+    bench.measure("検索: n-gram絞り込み+採点", search_once, repeat=len(conditions))
+
+    ngrams, engine.ngrams = engine.ngrams, NoPruning()
+    try:
+        it = iter(conditions)
+        bench.measure("検索: 全行採点（比較用）", search_once, repeat=min(len(conditions), 30))
+    finally: engine.ngrams = ngrams
+
+    cache = QueryResultCache(max_items=512)
+    popular = [rng.choice(conditions[:20]) for _ in range(args.queries)]  # 多くの端末が同じ条件で検索する想定
+    it = iter(popular)
+    def cached_once():
+        q, store, category = next(it)
+        key = (q, store, category, snapshot.version)
+        positions = cache.get(key)
+        if positions is None: positions = cache.put(key, engine.search(q, facets.filter(store, category))[0])
+        return positions
+    bench.measure("検索: 共有キャッシュ経由", cached_once, repeat=len(popular))
+    bench.note("  └ キャッシュ", **{"件数": json.dumps(cache.stats(), ensure_ascii=False)})
+    bench.measure("絞り込み: 業態×カテゴリ", lambda: facets.filter(rng.choice(stores), rng.choice(facets.category_options or ["すべて"])), repeat=1000)
+
+    # --- 欠品照会・検定・既読・印刷 ---
+    skus = rng.sample(list(snapshot.ingredient_dict), min(args.stockout_skus, len(snapshot.ingredient_dict)))
+    codes = [snapshot.ingredient_dict[name]["商品コード"] for name in skus]
+    def stockout():
+        keys, _ = snapshot.usage_index.resolve(codes)
+        return snapshot.usage_index.usage(keys), snapshot.usage_index.recipes_using(keys)
+    bench.measure(f"欠品照会: {len(codes)}商品", stockout, items=len(codes), repeat=10)
+    bench.measure("検定: 問題生成", lambda: snapshot.quiz_bank.questions(rng, 100), items=100, repeat=10)
+    store_names = list(snapshot.read_index.by_store)
+    bench.measure("既読: 店舗ごとの既読タイトル", lambda: [snapshot.read_index.read_titles(s) for s in store_names], items=len(store_names), repeat=10)
+
+    spans = ingredient_spans(snapshot.ing_table)
+    sample = snapshot.df.iloc[rng.sample(range(len(snapshot.df)), min(args.prints, len(snapshot.df)))]
+    def print_all():
+        for rid, row in sample.iterrows():
+            start, stop = spans.get(rid, (0, 0))
+            generate_print_html(row, snapshot.ing_table.iloc[start:stop])
+    bench.measure("印刷: HTML生成", print_all, items=len(sample))
+
+    # --- 再起動時の復元 ---
+    disk = SnapshotDisk(os.path.join(workdir, "snapshot"))
+    bench.measure("スナップショット: Parquet保存", lambda: disk.save(snapshot))
+    bench.measure("スナップショット: Parquetから復元", disk.load)
+
+    server.shutdown()
+    if not args.data_dir and not args.keep: shutil.rmtree(workdir, ignore_errors=True)
+    return bench.report()
+
+
+def compare(report, previous_path):
+    previous = pd.DataFrame(json.load(open(previous_path, encoding="utf-8")))
+    merged = report[["段階", "秒"]].merge(previous[["段階", "秒"]], on="段階", how="left", suffixes=("", "(前回)"))
+    merged["比"] = (merged["秒"] / merged["秒(前回)"]).round(2)
+    return merged.dropna(subset=["秒"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="レシピビューアの読み込み・検索・印刷のベンチマーク")
+    parser.add_argument("--recipes", type=int, default=10000)
+    parser.add_argument("--skus", type=int, default=20000)
+    parser.add_argument("--log-rows", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--stockout-skus", type=int, default=300)
+    parser.add_argument("--prints", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="CSVの出力先（指定すると残す）")
+    parser.add_argument("--keep", action="store_true", help="一時ディレクトリを消さない")
+    parser.add_argument("--json", help="結果をJSONで保存する（--compareで比較に使う）")
+    parser.add_argument("--compare", help="前回の--jsonの結果と秒数を比べる")
+    args = parser.parse_args()
+
+    report = run(args)
+    with pd.option_context("display.max_rows", None, "display.max_columns", None, "display.width", 200):
+        print(report.fillna("").to_string(index=False))
+        if args.compare:
+            print()
+            print(compare(report, args.compare).to_string(index=False))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f: json.dump(report.to_dict(orient="records"), f, ensure_ascii=False, indent=1)
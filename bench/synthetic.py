@@ -0,0 +1,92 @@
+# ベンチマーク用の合成データ（スプレッドシートと同じ列構成のCSV）を作る
+# python bench/synthetic.py 出力先 --recipes 10000 --skus 20000 --log-rows 1000000
+import argparse
+import csv
+import os
+import random
+
+FOODS = [
+    "ポテト", "玉ねぎ", "にんじん", "キャベツ", "レタス", "トマト", "きゅうり", "ピーマン", "なす", "ブロッコリー",
+    "鶏もも肉", "鶏むね肉", "豚バラ肉", "豚ロース", "牛肩ロース", "合いびき肉", "ベーコン", "ハム", "ソーセージ", "えび",
+    "サーモン", "まぐろ", "いか", "あさり", "卵", "牛乳", "生クリーム", "バター", "チーズ", "ヨーグルト",
+    "小麦粉", "パン粉", "片栗粉", "米", "パスタ", "うどん", "中華麺", "食パン", "バンズ", "トルティーヤ",
+    "醤油", "味噌", "みりん", "酒", "砂糖", "塩", "こしょう", "サラダ油", "オリーブオイル", "ごま油",
+    "マヨネーズ", "ケチャップ", "ウスターソース", "デミグラスソース", "トマトソース", "カレールー", "コンソメ", "鶏がらスープ", "にんにく", "しょうが",
+]
+PACKS = ["業務用", "冷凍", "1kg", "500g", "カット済", "国産", "輸入", "徳用", "小袋", "缶"]
+DISHES = ["フライ", "ソテー", "炒め", "煮込み", "グラタン", "サラダ", "スープ", "カレー", "パスタ", "丼", "バーガー", "ピザ", "唐揚げ", "ハンバーグ", "オムレツ"]
+CATEGORIES = ["主菜", "副菜", "サイド", "デザート", "ドリンク", "スープ"]
+STORE_TYPES = ["A", "AB", "カフェ", "バー", "フードコート", "ベーカリー", "居酒屋", "テイクアウト", "ホテル", "宴会"]
+
+
+def sku_names(n, rng):
+    # 商品名は一意（マスタの重複はload_dataでエラーになる）
+    names = []
+    for i in range(n):
+        names.append(f"{rng.choice(FOODS)}{rng.choice(PACKS)} {i:05d}")
+    return names
+
+
+def write_csv(path, header, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def recipe_rows(n_recipes, skus, rng, lines_per_recipe=8, start=0):
+    # 材料はマスタの商品名そのまま（7割）、食材名だけ（2割・部分一致で解決される）、マスタにない名前（1割）を混ぜる
+    for i in range(start, start + n_recipes):
+        lines = []
+        for _ in range(lines_per_recipe):
+            r = rng.random()
+            if r < 0.7: name = rng.choice(skus)
+            elif r < 0.9: name = rng.choice(FOODS)
+            else: name = f"未登録食材{rng.randint(0, 5000)}"
+            lines.append(f"{name}、{rng.randint(1, 500)}g、{rng.choice(['', '下味用', '仕上げ', '別添え'])}")
+        title = f"{rng.choice(FOODS)}の{rng.choice(DISHES)} {i}"
+        yield [
+            title, "\n".join(lines), "\n".join(f"手順{s + 1}: {rng.choice(FOODS)}を{rng.choice(['切る', '焼く', '煮る', '和える'])}" for s in range(5)),
+            rng.randint(5, 60), rng.choice(CATEGORIES), "、".join(rng.sample(STORE_TYPES, rng.randint(1, 3))),
+            "-", "", "平皿", "フォーク", "アレルゲン注意",
+        ]
+
+
+RECIPE_HEADER = ["title", "ingredients", "steps", "time", "category", "target_stores", "image", "video", "tableware", "cutlery", "caution"]
+LOG_HEADER = ["タイムスタンプ", "店舗名", "確認した記事"]
+
+
+def log_rows(n_rows, stores, news_titles, rng):
+    for i in range(n_rows):
+        yield [f"2026/{1 + i % 12:02d}/{1 + i % 28:02d} 12:00:00", rng.choice(stores), rng.choice(news_titles)]
+
+
+def generate(directory, recipes=10000, skus=20000, log_rows_count=1000000, stores=500, news=200, seed=0):
+    # 戻り値: シート名 → CSVのパス（load_dataのSOURCESと同じキー）
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    names = sku_names(skus, rng)
+    store_names = [f"店舗{i:04d}" for i in range(stores)]
+    news_titles = [f"お知らせ{i}" for i in range(news)]
+    paths = {name: os.path.join(directory, f"{name}.csv") for name in ["recipe", "ingredient", "news", "store", "news_log"]}
+
+    write_csv(paths["recipe"], RECIPE_HEADER, recipe_rows(recipes, names, rng))
+    write_csv(paths["ingredient"], ["商品名", "商品コード", "賞味期限", "開封後温度帯", "開封後賞味期限目安"],
+              ([name, f"C{i:06d}", f"{rng.randint(3, 365)}日", rng.choice(["冷蔵", "冷凍", "常温"]), f"{rng.randint(1, 7)}日"] for i, name in enumerate(names)))
+    write_csv(paths["news"], ["title", "content", "date", "important"],
+              ([title, f"{title}の内容", f"2026/{1 + i % 12:02d}/{1 + i % 28:02d}", "TRUE" if i % 20 == 0 else "FALSE"] for i, title in enumerate(news_titles)))
+    write_csv(paths["store"], ["store_code", "password", "store_name"], ([f"{i:04d}", f"pw{i}", name] for i, name in enumerate(store_names)))
+    write_csv(paths["news_log"], LOG_HEADER, log_rows(log_rows_count, store_names, news_titles, rng))
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ベンチマーク用の合成CSVを作る")
+    parser.add_argument("directory")
+    parser.add_argument("--recipes", type=int, default=10000)
+    parser.add_argument("--skus", type=int, default=20000)
+    parser.add_argument("--log-rows", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for name, path in generate(args.directory, args.recipes, args.skus, args.log_rows, seed=args.seed).items():
+        print(f"{name}: {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
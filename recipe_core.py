@@ -0,0 +1,1577 @@
+# レシピビューアの中核ロジック（データ読み込み・索引・検索・キャッシュ・印刷HTML）
+# Streamlitに依存しないので、app.py以外（ベンチマークなど）からもimportして使える
+import time
+import sys
+import math
+import threading
+import contextlib
+from types import MappingProxyType
+import io
+import json
+import shutil
+import sqlite3
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from collections import deque, OrderedDict
+import unicodedata
+import os
+import base64
+import pandas as pd
+import numpy as np
+from rapidfuzz import fuzz, process
+from PIL import Image, ImageOps
+
+
+# --- 処理時間・件数の計測（プロセス全体で集計） ---
+class PerfMonitor:
+    # 処理段階ごとの所要時間（直近window件）とカウンタを全セッション分まとめて持つ
+    # log_pathを指定すると、計測1回ごとにJSON Linesで書き出す
+    def __init__(self, window=1000, log_path=None):
+        self.window = window
+        self.log_path = log_path
+        self._timings = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._log = open(log_path, "a", encoding="utf-8", buffering=1) if log_path else None
+
+    @contextlib.contextmanager
+    def span(self, stage, **fields):
+        # with perf.span("段階") as info: ... info["rows"] = n のように、ログに残す項目を後から足せる
+        started = time.perf_counter()
+        try: yield fields
+        finally: self.observe(stage, (time.perf_counter() - started) * 1000, **fields)
+
+    def observe(self, stage, ms, **fields):
+        with self._lock:
+            self._timings.setdefault(stage, deque(maxlen=self.window)).append(ms)
+            if self._log: self._log.write(json.dumps({"ts": round(time.time(), 3), "stage": stage, "ms": round(ms, 2), **fields}, ensure_ascii=False, default=str) + "\n")
+
+    def count(self, name, n=1):
+        with self._lock: self._counters[name] = self._counters.get(name, 0) + n
+
+    def timing_report(self):
+        with self._lock: timings = {stage: np.array(values) for stage, values in self._timings.items()}
+        rows = []
+        for stage, values in sorted(timings.items()):
+            rows.append({"処理": stage, "回数": len(values), "p50(ms)": round(float(np.percentile(values, 50)), 1),
+                         "p95(ms)": round(float(np.percentile(values, 95)), 1), "最大(ms)": round(float(values.max()), 1)})
+        return pd.DataFrame(rows, columns=["処理", "回数", "p50(ms)", "p95(ms)", "最大(ms)"])
+
+    def counter_report(self):
+        with self._lock: counters = dict(self._counters)
+        return pd.DataFrame(sorted(counters.items()), columns=["項目", "累計"])
+
+
+# --- あいまい検索エンジン（load_dataで一度だけ構築） ---
+HIRAGANA_TO_KATAKANA = {code: code + 0x60 for code in range(ord("ぁ"), ord("ゖ") + 1)}
+
+def normalize_text(text):
+    # 検索語・検索対象の表記をそろえる
+    # NFKCで全角英数・半角カナを統一し、ひらがなはカタカナに寄せる（音声入力はひらがなで返ることが多い）
+    return unicodedata.normalize("NFKC", str(text)).lower().translate(HIRAGANA_TO_KATAKANA)
+
+class NgramIndex:
+    # 文字n-gram → それを含む行番号の転置インデックス。あいまい採点の前に候補行を絞り込む
+    # 短いクエリ（short文字以下）は1文字単位で引く。「鶏肉」と「鶏もも肉」のように2文字の並びを共有しなくても部分一致で当たるため
+    # （1文字も共有しない行は部分一致の点数が0なので、1文字単位の絞り込みでは当たる行を落とさない）
+    def __init__(self, documents, n=2, short=3):
+        self.n, self.short = n, short
+        self.size = len(documents)
+        postings = {}
+        for pos, texts in enumerate(documents):
+            for gram in self._grams(texts):
+                postings.setdefault(gram, []).append(pos)
+        self.postings = {gram: np.array(rows, dtype=np.int32) for gram, rows in postings.items()}
+
+    def _grams(self, texts):
+        # n-gramと1文字の両方（長さが違うので同じ辞書に置いても混ざらない）
+        grams = {text[i:i + self.n] for text in texts for i in range(len(text) - self.n + 1)}
+        grams.update(ch for text in texts for ch in text)
+        return grams
+
+    def updated(self, changes, size):
+        # changes: 行番号 → (前回の文書, 今回の文書)。追加した行の前回・削除した行の今回はNone
+        # 変わった行が含むn-gramの転置リストだけを作り直し、他は前回の配列を共有する
+        removed, added = {}, {}
+        for pos, (old, new) in changes.items():
+            old_grams = self._grams(old) if old is not None else set()
+            new_grams = self._grams(new) if new is not None else set()
+            for gram in old_grams - new_grams: removed.setdefault(gram, []).append(pos)
+            for gram in new_grams - old_grams: added.setdefault(gram, []).append(pos)
+        postings = dict(self.postings)
+        for gram in removed.keys() | added.keys():
+            rows = postings.get(gram, np.zeros(0, dtype=np.int32))
+            if gram in removed: rows = rows[~np.isin(rows, removed[gram])]
+            if gram in added: rows = np.union1d(rows, added[gram]).astype(np.int32)
+            if len(rows): postings[gram] = rows
+            else: postings.pop(gram, None)
+        index = NgramIndex([], self.n, self.short)
+        index.size, index.postings = size, postings
+        return index
+
+    def candidates(self, query, positions=None, max_candidates=2000):
+        # クエリとn-gramを1つ以上共有する行番号。positionsを渡すとその中から並び順を保って、なければ全行から昇順で
+        # 多すぎるときは共有数の多い順に上限まで（上限は業態・カテゴリで絞った後の件数にかける）
+        # 空のクエリは絞り込めないのでNone（全行が対象）
+        n = 1 if len(query) <= self.short else self.n
+        grams = {query[i:i + n] for i in range(len(query) - n + 1)} - {" "}
+        if not grams: return None
+        lists = [self.postings[g] for g in grams if g in self.postings]
+        if not lists: return np.zeros(0, dtype=np.int64)
+        counts = np.bincount(np.concatenate(lists), minlength=self.size)
+        rows = np.flatnonzero(counts) if positions is None else positions[counts[positions] > 0]
+        if len(rows) > max_candidates:
+            cutoff = np.partition(counts[rows], len(rows) - max_candidates)[len(rows) - max_candidates]
+            rows = rows[counts[rows] >= cutoff]
+        return rows
+
+class RecipeSearchEngine:
+    # 料理名・材料を正規化した検索用コーパスを保持し、n-gramで絞った候補行をまとめて採点する
+    def __init__(self, titles, ingredients, row_ids):
+        self.row_ids = list(row_ids)
+        self.titles = [normalize_text(t) for t in titles]
+        self.ingredients = [normalize_text(" ".join(x) if isinstance(x, list) else x) for x in ingredients]
+        self.ngrams = NgramIndex(list(zip(self.titles, self.ingredients)))
+
+    @classmethod
+    def from_corpora(cls, title_corpus, ingredient_corpus, row_ids):
+        # 正規化済みのコーパス（行ごとにキャッシュしたもの）からそのまま組み立てる
+        engine = cls([], [], [])
+        engine.row_ids, engine.titles, engine.ingredients = list(row_ids), list(title_corpus), list(ingredient_corpus)
+        engine.ngrams = NgramIndex(list(zip(engine.titles, engine.ingredients)))
+        return engine
+
+    @classmethod
+    def deferred(cls, titles, ingredients, row_ids):
+        # 正規化とn-gramの構築を、初めて検索に使われるとき（またはwarm_indexes）まで遅らせる
+        engine = object.__new__(cls)
+        engine.row_ids = list(row_ids)
+        engine._pending = (list(titles), list(ingredients), threading.Lock())
+        return engine
+
+    def __getattr__(self, name):
+        # deferredで作ったエンジンは、titles/ingredients/ngramsを初めて参照したときに組み立てる
+        pending = self.__dict__.get("_pending")
+        if pending is None or name not in ("titles", "ingredients", "ngrams"): raise AttributeError(name)
+        titles, ingredients, lock = pending
+        with lock:
+            if "ngrams" not in self.__dict__:
+                built = RecipeSearchEngine(titles, ingredients, self.row_ids)
+                self.titles, self.ingredients = built.titles, built.ingredients
+                self.ngrams = built.ngrams  # 最後に置く（他のスレッドはngramsがあれば組み立て済みとみなす）
+        return self.__dict__[name]
+
+    def updated(self, changed, title_corpus, ingredient_corpus, row_ids):
+        # changed: 内容が変わった行番号（末尾への追加・末尾からの削除を含む）。n-gramはその行の分だけ更新する
+        size = len(row_ids)
+        changes = {
+            pos: ((self.titles[pos], self.ingredients[pos]) if pos < len(self.titles) else None,
+                  (title_corpus[pos], ingredient_corpus[pos]) if pos < size else None)
+            for pos in changed
+        }
+        engine = RecipeSearchEngine([], [], [])
+        engine.row_ids, engine.titles, engine.ingredients = list(row_ids), list(title_corpus), list(ingredient_corpus)
+        engine.ngrams = self.ngrams.updated(changes, size)
+        return engine
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    def search(self, query, positions=None, threshold=60, title_weight=1.1, stats=None):
+        # positions: 採点対象の行番号（Noneなら全行）。戻り値はスコア順の行番号とスコア
+        # stats: dictを渡すと、実際に採点した行数を"scanned"に入れる
+        if positions is None: positions = np.arange(len(self.row_ids))
+        positions = np.asarray(positions, dtype=np.int64)
+        if stats is not None: stats["scanned"] = 0
+        if len(positions) == 0 or not query:
+            return positions, np.zeros(len(positions))
+
+        q = normalize_text(query)
+        # n-gramを共有しない行は採点しない（絞り込み条件の並び順は保つ）
+        # 1行も残らないとき（2文字の並びをどの行とも共有しない表記ゆれなど）は絞り込まずに全行を採点する
+        candidates = self.ngrams.candidates(q, positions)
+        if candidates is not None and len(candidates): positions = candidates
+        if stats is not None: stats["scanned"] = len(positions)
+        titles = [self.titles[i] for i in positions]
+        ingredients = [self.ingredients[i] for i in positions]
+        title_scores = process.cdist([q], titles, scorer=fuzz.partial_ratio, dtype=np.float64, workers=-1)[0]
+        ing_scores = process.cdist([q], ingredients, scorer=fuzz.partial_ratio, dtype=np.float64, workers=-1)[0]
+        scores = np.maximum(title_scores * title_weight, ing_scores)
+
+        hits = np.flatnonzero(scores > threshold)
+        order = hits[np.argsort(-scores[hits], kind="stable")]
+        return positions[order], scores[order]
+
+
+# --- 食材名 → 食材マスタ（商品名）の解決インデックス ---
+def build_ingredient_index(names, master_keys):
+    # 完全一致を優先し、なければマスタの並び順で最初に食材名を含む商品名に解決する
+    # 部分一致はAho-Corasickオートマトンで全商品名を一度だけ走査して求める
+    master_keys = list(master_keys)
+    master_set = set(master_keys)
+    index = {}
+    pending = set()
+    for name in names:
+        if name in master_set: index[name] = name
+        else: pending.add(name)
+
+    if "" in pending:
+        pending.discard("")
+        if master_keys: index[""] = master_keys[0]
+
+    if len(pending) <= 16:
+        # 差分更新で数件だけ解き直すときは、オートマトンを作るより商品名を順に調べる方が早い
+        for name in pending:
+            key = next((key for key in master_keys if name in key), None)
+            if key is not None: index[name] = key
+        return index, sorted(name for name in pending if name not in index)
+
+    goto, fail, out = [{}], [0], [[]]
+    for name in pending:
+        node = 0
+        for ch in name:
+            if ch not in goto[node]:
+                goto[node][ch] = len(goto)
+                goto.append({}); fail.append(0); out.append([])
+            node = goto[node][ch]
+        out[node].append(name)
+
+    queue = list(goto[0].values())
+    for node in queue:
+        for ch, child in goto[node].items():
+            f = fail[node]
+            while f and ch not in goto[f]: f = fail[f]
+            fail[child] = goto[f].get(ch, 0) if goto[f].get(ch, 0) != child else 0
+            out[child] = out[child] + out[fail[child]]
+            queue.append(child)
+
+    remaining = len(pending)
+    for key in master_keys:
+        if not remaining: break
+        node = 0
+        for ch in key:
+            while node and ch not in goto[node]: node = fail[node]
+            node = goto[node].get(ch, 0)
+            for name in out[node]:
+                if name not in index:
+                    index[name] = key
+                    remaining -= 1
+
+    unresolved = sorted(name for name in pending if name not in index)
+    return index, unresolved
+
+
+# --- 業態・カテゴリの絞り込みインデックス ---
+def split_stores(cell):
+    return [store.strip() for store in str(cell).split("、") if store.strip()]
+
+class FacetIndex:
+    # 業態/カテゴリごとに該当行のビットマップ（boolの配列）を持ち、絞り込みは論理積で行う
+    # store_tokens: 行ごとの業態リスト（split_storesの結果）
+    def __init__(self, store_tokens, categories=None):
+        n = len(store_tokens)
+        self.size = n
+        self.stores = {}
+        for pos, tokens in enumerate(store_tokens):
+            for store in tokens:
+                if store not in self.stores: self.stores[store] = np.zeros(n, dtype=bool)
+                self.stores[store][pos] = True
+
+        self.categories = {}
+        if categories is not None:
+            codes, uniques = pd.factorize(pd.Series(categories), use_na_sentinel=False)
+            for code, cat in enumerate(uniques):
+                self.categories[cat] = codes == code
+
+        self.store_options = ["すべて"] + sorted(self.stores)
+        self.category_options = ["すべて"] + list(self.categories) if categories is not None else []
+
+    def filter(self, store="すべて", category="すべて"):
+        # 条件に合う行番号を返す（「すべて」は絞り込みなし）
+        mask = np.ones(self.size, dtype=bool)
+        if store != "すべて": mask &= self.stores.get(store, np.zeros(self.size, dtype=bool))
+        if category != "すべて": mask &= self.categories.get(category, np.zeros(self.size, dtype=bool))
+        return np.flatnonzero(mask)
+
+
+# --- 材料文字列をパースして縦持ちの食材テーブルにする関数 ---
+INGREDIENT_COLUMNS = ["recipe_id", "食材", "使用量", "備考", "master_key"]
+
+def parse_ingredient_lines(raw_text):
+    # 1行＝「食材、使用量、備考」。足りない項目は空文字にする
+    rows = []
+    for line in str(raw_text).split('\n'):
+        parts = line.split('、')
+        if len(parts) >= 3:
+            rows.append((parts[0], parts[1], parts[2]))
+        elif len(parts) == 2:
+            rows.append((parts[0], parts[1], ""))
+        elif len(parts) == 1 and parts[0].strip():
+            rows.append((parts[0], "", ""))
+    return rows
+
+def build_ingredient_table(recipe_ids, parsed_lines):
+    # parsed_lines: レシピごとの parse_ingredient_lines の結果
+    data = {col: [] for col in INGREDIENT_COLUMNS[:4]}
+    for rid, lines in zip(recipe_ids, parsed_lines):
+        for name, amount, note in lines:
+            data["recipe_id"].append(rid)
+            data["食材"].append(name)
+            data["使用量"].append(amount)
+            data["備考"].append(note)
+    table = pd.DataFrame(data, columns=INGREDIENT_COLUMNS[:4]).astype({"食材": str, "使用量": str, "備考": str})
+    table["master_key"] = None
+    return table
+
+def ingredient_spans(ing_table):
+    # recipe_id → テーブル内の行範囲（同じレシピの行は連続して並んでいる）
+    spans = {}
+    for pos, rid in enumerate(ing_table["recipe_id"].tolist()):
+        start, _ = spans.get(rid, (pos, pos))
+        spans[rid] = (start, pos + 1)
+    return spans
+
+
+# --- 食材 → 使用レシピの転置インデックス（欠品時の影響調査用） ---
+def group_frozensets(keys, values):
+    # キー → 値の集合（キーが欠損の行は除く）。groupbyで1グループずつSeriesを作るより大幅に速い
+    codes, uniques = pd.factorize(keys)
+    order = np.argsort(codes, kind="stable")
+    order = order[codes[order] >= 0]
+    if len(order) == 0: return {}
+    codes = codes[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(codes)) + 1]
+    parts = np.split(np.asarray(values, dtype=object)[order], starts[1:])
+    return {key: frozenset(part) for key, part in zip(np.asarray(uniques, dtype=object)[codes[starts]], parts)}
+
+class IngredientUsageIndex:
+    # マスタの商品名ごとに、その商品を使うレシピIDの集合を持つ。複数商品の照会は集合の和/積で求める
+    # マスタに解決できなかった食材は、シート上の表記のままで引けるようにしておく
+    # マスタに解決できたシート上の表記（「ポテト」など）は、解決先の商品名で引く
+    def __init__(self, ing_table, ing_dict):
+        self.by_key = group_frozensets(ing_table["master_key"], ing_table["recipe_id"])
+        unresolved = ing_table[ing_table["master_key"].isna()]
+        self.by_name = group_frozensets(unresolved["食材"], unresolved["recipe_id"])
+        resolved = ing_table.loc[ing_table["master_key"].notna(), ["食材", "master_key"]]
+        self.aliases = dict(zip(resolved["食材"].str.strip().tolist(), resolved["master_key"].tolist()))  # シート上の表記 → 商品名
+        self._set_master(ing_dict)
+
+    def _set_master(self, ing_dict):
+        self.master_keys = frozenset(ing_dict)
+        self.codes = {}  # 商品コード → 商品名
+        for key, info in ing_dict.items():
+            code = str(info.get("商品コード", "")).strip()
+            if code and code != "nan": self.codes[code] = key
+
+    def updated(self, ing_table, keys, names, ing_dict=None):
+        # keys/names: 使用レシピが変わりうる商品名・シート上の食材名。それ以外は前回の集合をそのまま使う
+        # ing_dict: 食材マスタが変わったときだけ渡す（商品コードの対応を作り直す）
+        index = object.__new__(IngredientUsageIndex)
+        index.by_key = {key: ids for key, ids in self.by_key.items() if key not in keys}
+        rows = ing_table[ing_table["master_key"].isin(keys)]
+        index.by_key.update(group_frozensets(rows["master_key"], rows["recipe_id"]))
+
+        index.by_name = {name: ids for name, ids in self.by_name.items() if name not in names}
+        rows = ing_table[ing_table["master_key"].isna() & ing_table["食材"].isin(names)]
+        index.by_name.update(group_frozensets(rows["食材"], rows["recipe_id"]))
+
+        stripped = {str(name).strip() for name in names}
+        index.aliases = {name: key for name, key in self.aliases.items() if name not in stripped}
+        sheet_names = ing_table["食材"].str.strip()
+        rows = ing_table.loc[ing_table["master_key"].notna() & sheet_names.isin(stripped), ["食材", "master_key"]]
+        index.aliases.update(zip(rows["食材"].str.strip().tolist(), rows["master_key"].tolist()))
+
+        if ing_dict is not None: index._set_master(ing_dict)
+        else: index.master_keys, index.codes = self.master_keys, self.codes
+        return index
+
+    def resolve(self, tokens):
+        # 商品コード・商品名・未登録の食材名を照会キーにそろえる。どれにも当たらないものは別に返す
+        keys, unknown = {}, []
+        for token in tokens:
+            token = str(token).strip()
+            if not token: continue
+            key = self.codes.get(token) or (token if token in self.master_keys else self.aliases.get(token, token))
+            if key in self.master_keys or key in self.by_name: keys[key] = True
+            else: unknown.append(token)
+        return list(keys), unknown
+
+    def recipes(self, key):
+        return self.by_key.get(key) or self.by_name.get(key, frozenset())
+
+    def recipes_using(self, keys, require_all=False):
+        # require_all=False: いずれかを使うレシピ / True: すべてを使うレシピ
+        sets = [self.recipes(key) for key in keys]
+        if not sets: return frozenset()
+        return frozenset.intersection(*sets) if require_all else frozenset().union(*sets)
+
+    def usage(self, keys):
+        # レシピID → 照会した商品のうち、そのレシピで使っているもの
+        hits = {}
+        for key in keys:
+            for rid in self.recipes(key): hits.setdefault(rid, []).append(key)
+        return hits
+
+
+# --- 検定の問題バンク（読み込み時に作っておく） ---
+class QuizBank:
+    # レシピごとに、紛らわしい別レシピ（共通する食材が多い・料理名が似ている・同じカテゴリ）を上位k件持っておく
+    # 全組み合わせは比べず、食材を共有する組だけを候補にする（多くのレシピで使われる食材は候補づくりに使わない）
+    def __init__(self, titles, categories, ing_table, recipe_ids, k=6, max_postings=200):
+        self.k, self.max_postings = k, max_postings
+        self._set_rows(titles, categories)
+        self.neighbors = np.full((len(self.titles), k), -1, dtype=np.int64)
+        if len(self.titles) and not ing_table.empty: self._fill(self._pairs(ing_table, recipe_ids)[0])
+
+    @classmethod
+    def deferred(cls, titles, categories, ing_table, recipe_ids, k=6, max_postings=200):
+        # 選択肢（neighbors）の計算を、初めて出題するとき（またはwarm_indexes）まで遅らせる
+        bank = object.__new__(cls)
+        bank.k, bank.max_postings = k, max_postings
+        bank._set_rows(titles, categories)
+        bank._pending = (titles, categories, ing_table, recipe_ids, threading.Lock())
+        return bank
+
+    def __getattr__(self, name):
+        pending = self.__dict__.get("_pending")
+        if pending is None or name != "neighbors": raise AttributeError(name)
+        titles, categories, ing_table, recipe_ids, lock = pending
+        with lock:
+            if "neighbors" not in self.__dict__:
+                self.neighbors = QuizBank(titles, categories, ing_table, recipe_ids, self.k, self.max_postings).neighbors
+        return self.__dict__[name]
+
+    def _set_rows(self, titles, categories):
+        self.titles = [str(t) for t in np.asarray(titles, dtype=object)]
+        n = len(self.titles)
+        cat_codes, _ = pd.factorize(pd.Series(np.asarray(categories, dtype=object) if categories is not None else [""] * n, dtype=object), use_na_sentinel=False)
+        self.by_category = [np.flatnonzero(cat_codes == c) for c in range(cat_codes.max() + 1)] if n else []
+        self.category_of = cat_codes
+
+    def _pairs(self, ing_table, recipe_ids):
+        # 行番号 × 食材（マスタ未解決なら表記そのまま）の組と、食材の値の一覧（keyは一覧の位置）
+        rows = pd.Index(recipe_ids).get_indexer(ing_table["recipe_id"])
+        keys, uniques = pd.factorize(ing_table["master_key"].fillna(ing_table["食材"]))
+        return pd.DataFrame({"pos": rows, "key": keys}).query("pos >= 0").drop_duplicates(), uniques
+
+    def _fill(self, pairs, targets=None):
+        # targets: 選択肢を求め直す行番号（Noneなら全行）
+        n = len(self.titles)
+        n_ingredients = np.bincount(pairs["pos"], minlength=n)
+
+        # 同じ食材を使うレシピ同士を組にして、共通食材の数を数える
+        sizes = pairs.groupby("key")["pos"].transform("size")
+        pairs = pairs[(sizes > 1) & (sizes <= self.max_postings)]
+        left = pairs if targets is None else pairs[pairs["pos"].isin(targets)]
+        joined = left.merge(pairs, on="key", suffixes=("_a", "_b"))
+        if targets is not None: self.neighbors[targets] = -1
+        if joined.empty: return
+        pair_codes = joined["pos_a"].to_numpy(dtype=np.int64) * n + joined["pos_b"].to_numpy(dtype=np.int64)
+        pair_codes, shared = np.unique(pair_codes, return_counts=True)
+        a, b = np.divmod(pair_codes, n)
+        title_codes, _ = pd.factorize(pd.Series(self.titles, dtype=object))
+        keep = title_codes[a] != title_codes[b]  # 自分自身・同名のレシピは選択肢にならない
+        a, b, shared = a[keep], b[keep], shared[keep]
+
+        # 類似度 = 食材のJaccard係数 + 同カテゴリ + 料理名の類似
+        # 料理名の比較は1組ずつになるので、食材とカテゴリで絞った上位4k件についてだけ行う
+        cat_codes, k = self.category_of, self.k
+        score = 0.6 * shared / (n_ingredients[a] + n_ingredients[b] - shared) + 0.2 * (cat_codes[a] == cat_codes[b])
+        a, b, score = self._top_per_row(a, b, score, 4 * k)
+        score = score + 0.4 * np.array([fuzz.ratio(self.titles[a_], self.titles[b_]) for a_, b_ in zip(a, b)]) / 100
+        a, b, _ = self._top_per_row(a, b, score, k)
+        rank = np.arange(len(a)) - np.searchsorted(a, a)
+        self.neighbors[a, rank] = b
+
+    def updated(self, titles, categories, ing_table, recipe_ids, rows, keys):
+        # rows: 食材・料理名・カテゴリが変わりうる行番号（末尾から削除した行も含めてよい）
+        # keys: それらの行が前回・今回に使っていた食材。その食材を使う行は選択肢が変わりうるので一緒に求め直す
+        bank = object.__new__(QuizBank)
+        bank.k, bank.max_postings = self.k, self.max_postings
+        bank._set_rows(titles, categories)
+        n = len(bank.titles)
+        bank.neighbors = np.full((n, self.k), -1, dtype=np.int64)
+        kept = min(n, len(self.neighbors))
+        bank.neighbors[:kept] = self.neighbors[:kept]
+        if n == 0 or ing_table.empty: return QuizBank(titles, categories, ing_table, recipe_ids, self.k, self.max_postings)
+        pairs, uniques = bank._pairs(ing_table, recipe_ids)
+        codes = uniques.get_indexer(list(keys)) if len(keys) else np.zeros(0, dtype=np.int64)
+        targets = np.union1d([r for r in rows if r < n], pairs.loc[pairs["key"].isin(codes[codes >= 0]), "pos"]).astype(np.int64)
+        bank._fill(pairs, targets)
+        return bank
+
+    @staticmethod
+    def _top_per_row(a, b, score, k):
+        # aごとにスコアの高い順でk件まで残す（戻り値はa昇順・スコア降順）
+        order = np.lexsort((-score, a))
+        a, b, score = a[order], b[order], score[order]
+        top = np.arange(len(a)) - np.searchsorted(a, a) < k
+        return a[top], b[top], score[top]
+
+    def __len__(self):
+        return len(self.titles)
+
+    def distractors(self, pos, rng, count=3):
+        # 似ているレシピから選び、足りなければ同じカテゴリ、それでも足りなければ全体から補う
+        chosen, seen = [], {self.titles[pos]}
+        def take(candidates):
+            for c in candidates:
+                if len(chosen) >= count: return
+                if c >= 0 and self.titles[c] not in seen:
+                    chosen.append(int(c))
+                    seen.add(self.titles[c])
+        near = [c for c in self.neighbors[pos] if c >= 0]
+        take(rng.sample(near, min(len(near), count + 1)))  # 毎回同じ組み合わせにならないよう上位から少し揺らす
+        if len(chosen) < count:
+            same = self.by_category[self.category_of[pos]]
+            take(rng.sample(list(same), min(len(same), 4 * count)))
+        if len(chosen) < count: take(rng.sample(range(len(self.titles)), min(len(self.titles), 4 * count)))
+        return chosen
+
+    def questions(self, rng, count):
+        # 出題順に{"position", "options", "correct_answer"}を返す。選択肢は料理名
+        questions = []
+        for pos in rng.sample(range(len(self.titles)), min(count, len(self.titles))):
+            options = [self.titles[c] for c in self.distractors(pos, rng)] + [self.titles[pos]]
+            if len(options) < 4: continue
+            rng.shuffle(options)
+            questions.append({"position": pos, "options": options, "correct_answer": self.titles[pos]})
+        return questions
+
+
+# --- 共有データスナップショット（プロセスで1つを全セッションが読み取り専用で参照する） ---
+class DataSnapshot:
+    FIELDS = ["df", "ingredient_dict", "df_news", "df_stores", "log_columns", "search_engine", "facets", "ing_table", "ing_spans", "unresolved_report", "read_index", "usage_index", "quiz_bank"]
+
+    def __init__(self, version, origin="network", row_cache=None, refresh_stats=None, missing_sheets=(), **data):
+        for name in self.FIELDS:
+            value = data[name]
+            if isinstance(value, dict): value = MappingProxyType(value)
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "origin", origin)
+        object.__setattr__(self, "row_cache", row_cache)  # 差分更新用の行単位キャッシュ（load_dataが参照）
+        object.__setattr__(self, "refresh_stats", refresh_stats or {})
+        object.__setattr__(self, "missing_sheets", frozenset(missing_sheets))  # まだ一度も正しく読めていないシート（空のまま）
+        object.__setattr__(self, "loaded_at", time.time())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DataSnapshot は読み取り専用です")
+
+    def memory_report(self):
+        rows = []
+        for name in self.FIELDS + ["row_cache"]:
+            rows.append({"項目": name, "サイズ(KB)": round(approx_size(getattr(self, name)) / 1024, 1)})
+        return pd.DataFrame(rows)
+
+
+def approx_size(obj):
+    # DataFrame/配列は実サイズ、dict/list/検索系オブジェクトは中身を1段たどった概算
+    if isinstance(obj, pd.DataFrame): return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, np.ndarray): return obj.nbytes
+    if isinstance(obj, (dict, MappingProxyType)):
+        return sys.getsizeof(dict(obj)) + sum(sys.getsizeof(k) + approx_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set)):
+        return sys.getsizeof(obj) + sum(sys.getsizeof(v) for v in obj)
+    if hasattr(obj, "__dict__"): return sum(approx_size(v) for v in vars(obj).values())
+    return sys.getsizeof(obj)
+
+
+class SnapshotStore:
+    # 初回だけは読み込みを待つ（ディスクに前回分があればそれを即座に使う）。以降はTTL切れでも
+    # 手元のスナップショットを返しつつバックグラウンドで1スレッドだけが再読み込みし、完成したら参照ごと差し替える
+    def __init__(self, loader, ttl=60, disk=None):
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._refreshing = False
+        self.ttl = ttl
+        self.disk = disk
+        self.last_error = None
+        self.refresh_log = deque(maxlen=20)
+
+    def get(self):
+        if self._snapshot is None:
+            with self._lock:
+                if self._snapshot is None and self.disk is not None:
+                    self._snapshot = self.disk.load()
+                if self._snapshot is None: self._refresh()
+        if time.time() - self._checked_at >= self.ttl:
+            self._start_background_refresh()
+        return self._snapshot
+
+    def _refresh(self):
+        previous = self._snapshot
+        try: self._snapshot = self._loader(previous)
+        finally: self._checked_at = time.time()
+        if self._snapshot is not previous and self._snapshot.refresh_stats:
+            self.refresh_log.appendleft({"版": self._snapshot.version, **self._snapshot.refresh_stats})
+        if self.disk is not None and self._snapshot is not previous:
+            # 空のシートを含むスナップショットで、前回正しく保存したもの（オフライン時の頼り）を上書きしない
+            if self._snapshot.missing_sheets:
+                self.last_error = f"スナップショット未保存: 読めていないシート {','.join(sorted(self._snapshot.missing_sheets))}"
+            else:
+                try: self.disk.save(self._snapshot)
+                except Exception as e: self.last_error = f"スナップショット保存失敗 {type(e).__name__}: {e}"
+
+    def _start_background_refresh(self):
+        with self._lock:
+            if self._refreshing: return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.last_error = None
+                self._refresh()
+            except Exception as e: self.last_error = f"{type(e).__name__}: {e}"
+            finally: self._refreshing = False
+        threading.Thread(target=run, name="snapshot-refresh", daemon=True).start()
+
+
+class SnapshotDisk:
+    # 処理済みのスナップショットをParquetで保存し、起動時にネットワークを待たずに復元する
+    # バージョンごとのディレクトリに書き切ってから CURRENT を置き換えるので、書き込み途中の状態は読まれない
+    # 既読ログは全行ではなく店舗ごとの既読タイトル（ReadStateIndex）だけを置く（再起動後の最初の読み込みでログは全件読み直すため）
+    # 店舗シートはprepare_storesでパスワードをハッシュにしたものなので、平文のパスワードはディスクに書かれない
+    TABLES = {"recipes": "df", "ingredients": "ing_table", "news": "df_news", "stores": "df_stores", "unresolved": "unresolved_report"}
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def save(self, snapshot):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"v{snapshot.version:06d}-{time.time_ns()}"
+        tmp = os.path.join(self.directory, name + ".tmp")
+        os.makedirs(tmp)
+        for file_name, field in self.TABLES.items():
+            parquet_ready(getattr(snapshot, field)).to_parquet(os.path.join(tmp, f"{file_name}.parquet"))
+        master = pd.DataFrame.from_dict(dict(snapshot.ingredient_dict), orient="index")
+        master.index.name = "商品名"
+        parquet_ready(master.reset_index()).to_parquet(os.path.join(tmp, "master.parquet"))
+        by_store = snapshot.read_index.by_store
+        pd.DataFrame({
+            "店舗名": [store for store, titles in by_store.items() for _ in titles],
+            "確認した記事": [title for titles in by_store.values() for title in titles],
+        }).to_parquet(os.path.join(tmp, "read_state.parquet"))
+        with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": snapshot.version, "saved_at": time.time(), "log_rows": snapshot.read_index.rows,
+                       "log_columns": list(snapshot.log_columns)}, f)
+        os.rename(tmp, os.path.join(self.directory, name))
+
+        pointer = os.path.join(self.directory, "CURRENT")
+        with open(pointer + ".tmp", "w", encoding="utf-8") as f: f.write(name)
+        os.replace(pointer + ".tmp", pointer)
+        for old in os.listdir(self.directory):
+            if old not in (name, "CURRENT") and old.startswith("v"):
+                shutil.rmtree(os.path.join(self.directory, old), ignore_errors=True)
+
+    def load(self):
+        # n-gramと検定の選択肢は組み立てを遅らせ、返したあとにバックグラウンドで用意する
+        try:
+            with open(os.path.join(self.directory, "CURRENT"), encoding="utf-8") as f: name = f.read().strip()
+            path = os.path.join(self.directory, name)
+            with open(os.path.join(path, "manifest.json"), encoding="utf-8") as f: manifest = json.load(f)
+            tables = {field: pd.read_parquet(os.path.join(path, f"{file_name}.parquet")) for file_name, field in self.TABLES.items()}
+            master = pd.read_parquet(os.path.join(path, "master.parquet"))
+            read_state = pd.read_parquet(os.path.join(path, "read_state.parquet"))
+        except Exception:
+            return None
+
+        df_recipe = tables["df"]
+        if "ingredients" in df_recipe.columns: df_recipe["ingredients"] = df_recipe["ingredients"].map(list)
+        if "password" in tables["df_stores"].columns: tables["df_stores"] = prepare_stores(tables["df_stores"])  # 以前の形式で保存したもの
+        columns = [col for col in master.columns if col != "商品名"]
+        ing_dict = {
+            key: dict(zip(columns, values))
+            for key, *values in zip(master["商品名"].tolist(), *(master[col].tolist() for col in columns))
+        } if "商品名" in master.columns else {}
+        read_index = ReadStateIndex(group_frozensets(read_state["店舗名"], read_state["確認した記事"]), manifest.get("log_rows", 0))
+        snapshot = DataSnapshot(
+            manifest["version"], origin="disk", ingredient_dict=ing_dict, read_index=read_index,
+            log_columns=tuple(manifest.get("log_columns", [])), **tables,
+            **build_lookup_indexes(df_recipe, tables["ing_table"], ing_dict, deferred=True),
+        )
+        threading.Thread(target=warm_indexes, args=(snapshot,), name="snapshot-warmup", daemon=True).start()
+        return snapshot
+
+
+def warm_indexes(snapshot):
+    # 組み立てを遅らせた索引を先に作っておく（最初の検索・出題を待たせない）
+    snapshot.search_engine.ngrams
+    snapshot.quiz_bank.neighbors
+
+
+def parquet_ready(frame):
+    # スプレッドシート由来の混在型の列（数値と"-"など）はParquetに書けないので文字列にそろえる
+    frame = frame.copy()
+    for col in frame.columns:
+        if frame[col].dtype == object and col != "ingredients":
+            frame[col] = frame[col].map(lambda v: None if v is None or (isinstance(v, float) and math.isnan(v)) else v if isinstance(v, str) else str(v))
+    return frame
+
+
+# --- スプレッドシート（CSV公開）の取得 ---
+class SheetFetcher:
+    # 全シートを接続プール付きのセッションで並列取得する
+    # ETag/Last-Modifiedで条件付きGETを行い、失敗したシートは最後に取得できた内容を使い続ける
+    def __init__(self, sources, timeout=15):
+        self.sources = dict(sources)
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=len(self.sources), pool_maxsize=len(self.sources))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=len(self.sources), thread_name_prefix="sheet-fetch")
+        self.entries = {
+            name: {"body": None, "etag": None, "last_modified": None, "digest": None, "fetched_at": None, "error": None}
+            for name in self.sources
+        }
+
+    def _fetch_one(self, name):
+        # 内容が変わったらTrue（304・同一内容・失敗はFalse）
+        entry = self.entries[name]
+        headers = {}
+        if entry["etag"]: headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]: headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            res = self.session.get(self.sources[name], headers=headers, timeout=self.timeout)
+            if res.status_code == 304 and entry["body"] is not None:
+                entry.update(fetched_at=time.time(), error=None)
+                return False
+            res.raise_for_status()
+            digest = hashlib.sha1(res.content).hexdigest()
+            changed = digest != entry["digest"]
+            entry.update(
+                body=res.content, etag=res.headers.get("ETag"), last_modified=res.headers.get("Last-Modified"),
+                digest=digest, fetched_at=time.time(), error=None,
+            )
+            return changed
+        except Exception as e:
+            entry["error"] = f"{type(e).__name__}: {e}"
+            return False
+
+    def fetch_all(self):
+        # 変更があったシート名の集合を返す
+        futures = {name: self._executor.submit(self._fetch_one, name) for name in self.sources}
+        return {name for name, future in futures.items() if future.result()}
+
+    def body(self, name):
+        return self.entries[name]["body"]
+
+    def mark_failed(self, name, error):
+        # 取得はできたが読めなかった内容（エラーページなど）は覚えておかない
+        # 次回は条件付きGETにせず取り直し、同じ内容が返っても変更として読み直す
+        self.entries[name].update(etag=None, last_modified=None, digest=None, error=error)
+
+    def read_csv(self, name, **kwargs):
+        body = self.entries[name]["body"]
+        if body is None: raise ValueError(f"{name}: データを取得できていません")
+        return pd.read_csv(io.BytesIO(body), **kwargs)
+
+    def status_report(self):
+        rows = []
+        for name, entry in self.entries.items():
+            fetched = time.strftime("%H:%M:%S", time.localtime(entry["fetched_at"])) if entry["fetched_at"] else "-"
+            rows.append({"シート": name, "最終取得": fetched, "条件付きGET": bool(entry["etag"] or entry["last_modified"]), "エラー": entry["error"] or ""})
+        return pd.DataFrame(rows)
+
+
+# --- データ読み込み関数 ---
+def convert_google_drive_url(url):
+    url = str(url).strip()
+    if "drive.google.com" in url and "/d/" in url:
+        try:
+            file_id = url.split("/d/")[1].split("/")[0]
+            return f"https://drive.google.com/uc?export=view&id={file_id}"
+        except IndexError: return url
+    return url
+
+def recipe_row_artifacts(title, raw_ingredients, target_stores, image, video):
+    # 1行分の派生データ（材料のパース結果・検索用コーパス・業態・画像/動画URL）
+    lines = parse_ingredient_lines(raw_ingredients)
+    names = [name.strip() for name, _, _ in lines if name.strip()]
+    return {
+        "lines": lines,
+        "names": names,
+        "title_corpus": normalize_text("-" if pd.isna(title) else title),
+        "ingredient_corpus": normalize_text(" ".join(names)),
+        "stores": split_stores("-" if pd.isna(target_stores) else target_stores),
+        "image": convert_google_drive_url(image),
+        "video": convert_google_drive_url(video) if "drive.google.com" in str(video) else video,
+    }
+
+def require_columns(frame, sheet, columns):
+    # シートの代わりにエラーページ（HTML）などが返ると列がそろわないので、読み込み失敗として扱う
+    missing = [col for col in columns if col not in frame.columns]
+    if missing: raise ValueError(f"{sheet}: 必要な列がありません（{'、'.join(missing)}）")
+    return frame
+
+def prepare_recipes(df_recipe, previous_rows=None):
+    # 行の内容ハッシュが前回と同じ行はパースやURL変換をやり直さず、前回の派生データを使う
+    # （dtype=strで読むこと。数値列の型が他の行の空欄で変わってもハッシュが変わらないように）
+    # 戻り値: (整形済みdf, {ハッシュ: 派生データ}, 行順のハッシュ, 処理し直した行数)
+    df_recipe.columns = df_recipe.columns.str.replace('\n', '').str.replace('\r', '').str.strip()
+    require_columns(df_recipe, "recipe", ["title", "ingredients"])
+    hashes = [f"{h:016x}" for h in pd.util.hash_pandas_object(df_recipe, index=False)]
+    previous_rows = previous_rows or {}
+
+    df_recipe["ingredients_raw"] = df_recipe["ingredients"].fillna("") 
+    if "target_stores" not in df_recipe.columns: df_recipe["target_stores"] = "共通"
+
+    n = len(df_recipe)
+    rows, reprocessed = {}, 0
+    for h, title, raw, stores, image, video in zip(
+        hashes, df_recipe["title"] if "title" in df_recipe.columns else ["-"] * n, df_recipe["ingredients_raw"],
+        df_recipe["target_stores"], df_recipe["image"] if "image" in df_recipe.columns else [None] * n,
+        df_recipe["video"] if "video" in df_recipe.columns else [None] * n,
+    ):
+        if h in rows: continue
+        if h in previous_rows: rows[h] = previous_rows[h]
+        else:
+            rows[h] = recipe_row_artifacts(title, raw, stores, image, video)
+            reprocessed += 1
+
+    if "image" in df_recipe.columns: df_recipe["image"] = [rows[h]["image"] for h in hashes]
+    if "video" in df_recipe.columns: df_recipe["video"] = [rows[h]["video"] for h in hashes]
+    
+    for col in ["tableware", "cutlery", "caution"]:
+        if col not in df_recipe.columns:
+            df_recipe[col] = "-"
+    
+    df_recipe = df_recipe.fillna("-")
+    df_recipe["ingredients"] = [rows[h]["names"] for h in hashes]
+    return df_recipe, rows, hashes, reprocessed
+
+def recipe_artifacts_from_frame(df_recipe):
+    n = len(df_recipe)
+    columns = [df_recipe[col] if col in df_recipe.columns else [None] * n for col in ["title", "ingredients_raw", "target_stores", "image", "video"]]
+    return [recipe_row_artifacts(*values) for values in zip(*columns)]
+
+def prepare_ingredient_master(df_ing, previous_rows=None):
+    # 戻り値: (商品名 → 行の辞書, {ハッシュ: (商品名, 行の辞書)}, 処理し直した行数)
+    df_ing.columns = df_ing.columns.str.replace('\n', '').str.replace('\r', '').str.strip()
+    df_ing = require_columns(df_ing, "ingredient", ["商品名"]).fillna("-")
+    df_ing["商品名"] = df_ing["商品名"].astype(str).str.strip()
+    if df_ing["商品名"].duplicated().any(): raise ValueError("商品名が重複しています")
+
+    previous_rows = previous_rows or {}
+    hashes = [f"{h:016x}" for h in pd.util.hash_pandas_object(df_ing, index=False)]
+    columns = [col for col in df_ing.columns if col != "商品名"]
+    values = [df_ing[col].tolist() for col in columns]
+    ing_dict, rows, reprocessed = {}, {}, 0
+    for pos, (h, key) in enumerate(zip(hashes, df_ing["商品名"])):
+        if h in previous_rows: rows[h] = previous_rows[h]
+        else:
+            rows[h] = (key, {col: vals[pos] for col, vals in zip(columns, values)})
+            reprocessed += 1
+        ing_dict[key] = rows[h][1]
+    return ing_dict, rows, reprocessed
+
+def password_digest(store_code, password):
+    # 店舗コードを塩にしたSHA-256。ログイン時も同じ関数で比べる
+    return hashlib.sha256(f"{store_code}\x1f{password}".encode("utf-8")).hexdigest()
+
+def prepare_stores(df_stores):
+    # パスワードはここでハッシュ（password_hash列）に置き換え、平文はスナップショット（メモリ・ディスク）に残さない
+    df_stores = require_columns(df_stores, "store", ["store_code", "password"]).fillna("")
+    df_stores["store_code"] = df_stores["store_code"].str.strip()
+    df_stores["password_hash"] = [password_digest(code, password) for code, password in zip(df_stores["store_code"], df_stores["password"].str.strip())]
+    return df_stores.drop(columns=["password"])
+
+def resolve_ingredient_names(names, master_keys, previous=None, previous_keys=None):
+    # 食材名 → 商品名（未解決はNone）。前回の解決結果から、マスタの追加・削除で変わりうる名前だけを解き直す
+    # 戻り値: (解決結果, 解き直した名前の数)
+    names = list(names)
+    master_keys = list(master_keys)
+    if previous is not None:
+        old_set, new_set = set(previous_keys), set(master_keys)
+        # 残った商品名の並び順が変わった場合は「最初に含む商品名」が変わりうるので全件やり直す
+        if [k for k in previous_keys if k in new_set] != [k for k in master_keys if k in old_set]: previous = None
+    if previous is None:
+        index, _ = build_ingredient_index(names, master_keys)
+        return {name: index.get(name) for name in names}, len(names)
+
+    deleted = old_set - new_set
+    inserted = [k for k in master_keys if k not in old_set]
+    # 前回未解決だった名前が解決されうるのは商品名が追加されたときだけ（それは下の追加分との照合で拾う）
+    affected = {name for name in names if name not in previous or previous[name] in deleted}
+    if inserted:
+        hits, _ = build_ingredient_index([name for name in names if name not in affected], inserted)
+        affected.update(hits)
+
+    resolution = {name: previous[name] for name in names if name not in affected}
+    index, _ = build_ingredient_index(affected, master_keys)
+    resolution.update({name: index.get(name) for name in affected})
+    return resolution, len(affected)
+
+def build_recipe_indexes(df_recipe, artifacts, ing_dict, previous_resolution=None, previous_keys=None, previous=None, changed_rows=None):
+    # レシピ・食材マスタから派生する構造をまとめて作る。artifactsは行順の派生データ
+    # previousとchanged_rows（内容が変わった行番号。末尾への追加・末尾からの削除を含む）を渡すと、
+    # 前回のスナップショットの索引を、変わった行と解決先の変わった食材名の分だけ更新して作る
+    # レシピに登場する全食材名をマスタに解決しておく
+    name_counts = {}
+    for a in artifacts:
+        for name in {name for name, _, _ in a["lines"]}:
+            name_counts[name] = name_counts.get(name, 0) + 1
+    resolution, re_resolved = resolve_ingredient_names(name_counts, ing_dict, previous_resolution, previous_keys)
+    unresolved = sorted(name for name, key in resolution.items() if key is None)
+    unresolved_report = pd.DataFrame({"食材": unresolved, "使用レシピ数": [name_counts[n] for n in unresolved]})
+
+    if previous is None or changed_rows is None:
+        ing_table = build_ingredient_table(df_recipe.index, [a["lines"] for a in artifacts])
+        ing_table["master_key"] = ing_table["食材"].map(resolution)
+        derived = dict(df=df_recipe, ing_table=ing_table, unresolved_report=unresolved_report, **build_lookup_indexes(df_recipe, ing_table, ing_dict, artifacts))
+    else:
+        derived = dict(df=df_recipe, unresolved_report=unresolved_report, **update_lookup_indexes(
+            previous, df_recipe, artifacts, ing_dict, resolution, previous_resolution, sorted(changed_rows),
+        ))
+    return derived, resolution, re_resolved
+
+def update_lookup_indexes(previous, df_recipe, artifacts, ing_dict, resolution, previous_resolution, changed):
+    # 行番号がそのままrecipe_idであること（RangeIndex）が前提。changedは昇順
+    n, old_n = len(df_recipe), len(previous.df)
+    renamed = {name for name, key in resolution.items() if name in previous_resolution and previous_resolution[name] != key}
+    alive = [pos for pos in changed if pos < n]
+
+    # 食材テーブル: 変わっていないレシピの範囲は前回のテーブルから切り出し、変わったレシピの行だけ作ってつなぐ
+    counts = np.zeros(max(n, old_n), dtype=np.int64)
+    for rid, (start, stop) in previous.ing_spans.items(): counts[rid] = stop - start
+    old_bounds = np.concatenate([[0], np.cumsum(counts[:old_n])])
+    fresh = build_ingredient_table(df_recipe.index[alive], [artifacts[pos]["lines"] for pos in alive])
+    fresh["master_key"] = fresh["食材"].map(resolution)
+    fresh_bounds = np.concatenate([[0], np.cumsum([len(artifacts[pos]["lines"]) for pos in alive])])
+    pieces, done = [], 0
+    for i, pos in enumerate(alive):
+        if done < pos: pieces.append(previous.ing_table.iloc[old_bounds[done]:old_bounds[pos]])
+        pieces.append(fresh.iloc[fresh_bounds[i]:fresh_bounds[i + 1]])
+        done = pos + 1
+    if done < n: pieces.append(previous.ing_table.iloc[old_bounds[done]:old_bounds[n]])
+    ing_table = pd.concat(pieces, ignore_index=True) if pieces else fresh
+    if renamed:
+        mask = ing_table["食材"].isin(renamed)
+        ing_table.loc[mask, "master_key"] = ing_table.loc[mask, "食材"].map(resolution)
+
+    for pos in alive: counts[pos] = len(artifacts[pos]["lines"])
+    bounds = np.concatenate([[0], np.cumsum(counts[:n])])
+    ing_spans = {df_recipe.index[pos]: (int(bounds[pos]), int(bounds[pos + 1])) for pos in np.flatnonzero(counts[:n])}
+
+    # 変わった行が前回・今回に使っていた食材と、解決先の変わった食材名の前後の解決先
+    old_part = previous.ing_table[previous.ing_table["recipe_id"].isin(previous.df.index[[pos for pos in changed if pos < old_n]])]
+    names = set(old_part["食材"]) | set(fresh["食材"]) | renamed
+    keys = set(old_part["master_key"].dropna()) | set(fresh["master_key"].dropna())
+    keys |= {previous_resolution[name] for name in renamed} | {resolution[name] for name in renamed}
+    keys.discard(None)
+    quiz_keys = set(old_part["master_key"].fillna(old_part["食材"])) | set(fresh["master_key"].fillna(fresh["食材"]))
+    quiz_keys |= {previous_resolution[name] or name for name in renamed} | {resolution[name] or name for name in renamed}
+    quiz_rows = set(changed) | set(pd.Index(df_recipe.index).get_indexer(ing_table.loc[ing_table["食材"].isin(renamed), "recipe_id"]))
+
+    search_engine = previous.search_engine.updated(
+        changed, [a["title_corpus"] for a in artifacts], [a["ingredient_corpus"] for a in artifacts], df_recipe.index,
+    )
+    # 業態・カテゴリのビットマップは全行でも配列演算数回なので作り直す
+    facets = FacetIndex([a["stores"] for a in artifacts], df_recipe["category"] if "category" in df_recipe.columns else None)
+    usage_index = previous.usage_index.updated(ing_table, keys, names, None if ing_dict is previous.ingredient_dict else ing_dict)
+    quiz_bank = previous.quiz_bank.updated(
+        df_recipe["title"], df_recipe["category"] if "category" in df_recipe.columns else None, ing_table, df_recipe.index, quiz_rows, quiz_keys,
+    )
+    return dict(ing_table=ing_table, search_engine=search_engine, facets=facets, ing_spans=ing_spans, usage_index=usage_index, quiz_bank=quiz_bank)
+
+def build_lookup_indexes(df_recipe, ing_table, ing_dict, artifacts=None, deferred=False):
+    # 検索・絞り込み・材料参照用の索引（パース済みのデータから作れるもの）
+    # deferred=True: n-gramと検定の選択肢は初めて使われるときに作る（ディスクからの復元用）
+    ing_spans = ingredient_spans(ing_table)
+
+    if df_recipe.empty or "title" not in df_recipe.columns: search_engine = RecipeSearchEngine([], [], [])
+    elif artifacts is not None:
+        search_engine = RecipeSearchEngine.from_corpora(
+            [a["title_corpus"] for a in artifacts], [a["ingredient_corpus"] for a in artifacts], df_recipe.index,
+        )
+    elif deferred: search_engine = RecipeSearchEngine.deferred(df_recipe["title"], df_recipe["ingredients"], df_recipe.index)
+    else: search_engine = RecipeSearchEngine(df_recipe["title"], df_recipe["ingredients"], df_recipe.index)
+
+    if "target_stores" in df_recipe.columns:
+        store_tokens = [a["stores"] for a in artifacts] if artifacts is not None else [split_stores(c) for c in df_recipe["target_stores"]]
+        facets = FacetIndex(store_tokens, df_recipe["category"] if "category" in df_recipe.columns else None)
+    else: facets = FacetIndex([])
+
+    usage_index = IngredientUsageIndex(ing_table, ing_dict)
+    quiz_bank = (QuizBank.deferred if deferred else QuizBank)(
+        df_recipe["title"] if "title" in df_recipe.columns else [], df_recipe["category"] if "category" in df_recipe.columns else None,
+        ing_table, df_recipe.index,
+    )
+    return dict(search_engine=search_engine, facets=facets, ing_spans=ing_spans, usage_index=usage_index, quiz_bank=quiz_bank)
+
+# --- お知らせの既読状態（店舗名 → 既読タイトル） ---
+class ReadStateIndex:
+    # スナップショット間で共有されるので中身は書き換えない。追記分はextendedで新しいインデックスを作る
+    def __init__(self, by_store=None, rows=0):
+        self.by_store = by_store or {}
+        self.rows = rows
+
+    def extended(self, df_log_part):
+        by_store = dict(self.by_store)
+        if len(df_log_part) and {"店舗名", "確認した記事"} <= set(df_log_part.columns):
+            for store, titles in group_frozensets(df_log_part["店舗名"], df_log_part["確認した記事"]).items():
+                by_store[store] = by_store.get(store, frozenset()) | titles
+        return ReadStateIndex(by_store, self.rows + len(df_log_part))
+
+    def read_titles(self, store):
+        return self.by_store.get(store, frozenset())
+
+
+def prepare_news(df_news):
+    # 日付の解釈と新しい順の並び替えは読み込み時に一度だけ行う
+    df_news = require_columns(df_news, "news", ["title"]).fillna("")
+    if "date" in df_news.columns:
+        try: df_news = df_news.assign(date=pd.to_datetime(df_news["date"], errors='coerce')).sort_values("date", ascending=False)
+        except: pass
+    return df_news
+
+def log_fingerprint(body, offset, window=4096):
+    # 読み終えた位置までのログの目印（先頭と末尾の数KBだけ）。全体をハッシュし直すとログの長さに比例してしまう
+    return hashlib.sha1(body[:window] + body[max(0, offset - window):offset]).hexdigest()
+
+def load_news_log(body, previous=None, cache=None):
+    # 確認ログ（フォームの回答）は追記しかされないので、前回読んだバイト位置より後ろだけをパースして足す
+    # ログ本体はスナップショットに持たず、列名と既読インデックスだけを引き継ぐ（コストは追記された行数に比例）
+    # 戻り値: (列名, 既読インデックス, 新たに取り込んだ行数)
+    cache = cache if cache is not None else {}
+    if body is None: raise ValueError("news_log: データを取得できていません")
+    offset, fingerprint = cache.get("log_offset", 0), cache.get("log_fingerprint")
+    if previous is not None and fingerprint and len(body) >= offset and log_fingerprint(body, offset) == fingerprint:
+        columns = previous.log_columns
+        tail = body[offset:]
+        part = pd.read_csv(io.BytesIO(tail), header=None, names=list(columns), dtype=str).fillna("") if tail.strip() else pd.DataFrame(columns=list(columns))
+        read_index = previous.read_index.extended(part)
+    else:
+        part = require_columns(pd.read_csv(io.BytesIO(body), dtype=str), "news_log", ["店舗名", "確認した記事"]).fillna("")
+        columns, read_index = tuple(part.columns), ReadStateIndex().extended(part)
+    cache["log_offset"], cache["log_fingerprint"] = len(body), log_fingerprint(body, len(body))
+    return columns, read_index, len(part)
+
+
+def load_data(fetcher, previous=None, perf=None):
+    # 変更のあったシートだけを読み直す。何も変わっていなければ前回のスナップショットをそのまま返す
+    # レシピ・食材マスタは行単位の内容ハッシュで差分を取り、変わった行だけを処理し直す
+    # perf: 各段階の所要時間を記録するPerfMonitor（省略時は記録を捨てる）
+    if perf is None: perf = PerfMonitor(window=1)
+    with perf.span("読込: シート取得") as info:
+        changed = fetcher.fetch_all()
+        info["変更シート"] = sorted(changed)
+    if previous is not None and not changed: return previous
+    started = time.perf_counter()
+    changed, failed = set(changed), {}
+    def reuse(name): return previous is not None and name not in changed
+    def sheet_failed(name, error):
+        # 読めなかったシートは前回のスナップショットの内容を使い続ける（前回がなければ空）
+        failed[name] = f"{type(error).__name__}: {error}"
+        changed.discard(name)
+        fetcher.mark_failed(name, failed[name])
+    cache = dict(previous.row_cache) if previous is not None and previous.row_cache else {}
+    stats = {"時刻": time.strftime("%H:%M:%S"), "変更シート": ",".join(sorted(changed)) or "-"}
+    previous_order = cache.get("recipe_order", [])
+
+    if reuse("recipe"): df_recipe = previous.df
+    else:
+        try:
+            df_recipe, cache["recipes"], cache["recipe_order"], reprocessed = prepare_recipes(fetcher.read_csv("recipe", dtype=str), cache.get("recipes"))
+            stats["レシピ再処理"] = reprocessed
+        except Exception as e:
+            sheet_failed("recipe", e)
+            if previous is not None: df_recipe = previous.df
+            else:
+                df_recipe = pd.DataFrame()
+                cache["recipes"], cache["recipe_order"] = {}, []
+
+    if reuse("ingredient"): ing_dict = previous.ingredient_dict
+    else:
+        try:
+            ing_dict, cache["master"], reprocessed = prepare_ingredient_master(fetcher.read_csv("ingredient", dtype=str), cache.get("master"))
+            stats["マスタ再処理"] = reprocessed
+        except Exception as e:
+            sheet_failed("ingredient", e)
+            if previous is not None: ing_dict = previous.ingredient_dict
+            else:
+                ing_dict = {}
+                cache["master"] = {}
+
+    if reuse("news"): df_news = previous.df_news
+    else:
+        try: df_news = prepare_news(fetcher.read_csv("news"))
+        except Exception as e:
+            sheet_failed("news", e)
+            df_news = previous.df_news if previous is not None else pd.DataFrame()
+
+    if reuse("store"): df_stores = previous.df_stores
+    else:
+        try: df_stores = prepare_stores(fetcher.read_csv("store", dtype=str))
+        except Exception as e:
+            sheet_failed("store", e)
+            df_stores = previous.df_stores if previous is not None else pd.DataFrame()
+
+    if reuse("news_log"): log_columns, read_index = previous.log_columns, previous.read_index
+    else:
+        try: log_columns, read_index, stats["既読ログ追加行"] = load_news_log(fetcher.body("news_log"), previous, cache)
+        except Exception as e:
+            sheet_failed("news_log", e)
+            log_columns, read_index = (previous.log_columns, previous.read_index) if previous is not None else ((), ReadStateIndex())
+
+    if failed: stats["読込失敗"] = ",".join(sorted(failed))
+    if previous is not None and not changed: return previous  # 変わったシートがすべて読めなかった
+
+    if reuse("recipe") and reuse("ingredient"):
+        derived = {name: getattr(previous, name) for name in ["df", "search_engine", "facets", "ing_table", "ing_spans", "unresolved_report", "usage_index", "quiz_bank"]}
+    else:
+        artifacts = [cache["recipes"][h] for h in cache.get("recipe_order", [])]
+        changed_rows = None
+        if len(artifacts) != len(df_recipe):
+            # ディスクから復元したスナップショットには行キャッシュがないので作り直す
+            artifacts = recipe_artifacts_from_frame(df_recipe)
+            cache["recipes"], cache["recipe_order"] = {}, []
+        elif (previous is not None and {"title", "ingredients"} <= set(df_recipe.columns) & set(previous.df.columns)
+              and len(previous_order) == len(previous.df) and cache.get("resolution") is not None):
+            # レシピが空（初回から読めていない）ときは列がなく差分を取れないので、全件の組み立てに回す
+            # 同じ位置の行のハッシュを比べる。途中への挿入・削除で後ろの行が全部ずれたときは作り直した方が早い
+            new_order = cache["recipe_order"]
+            changed_rows = [pos for pos in range(max(len(new_order), len(previous_order)))
+                            if pos >= len(new_order) or pos >= len(previous_order) or new_order[pos] != previous_order[pos]]
+            if len(changed_rows) > max(100, len(new_order) // 10): changed_rows = None
+        with perf.span("読込: 索引構築", 行数=len(df_recipe), 差分行数=len(changed_rows) if changed_rows is not None else "全件"):
+            derived, cache["resolution"], stats["食材名解決"] = build_recipe_indexes(
+                df_recipe, artifacts, ing_dict, cache.get("resolution"), cache.get("master_keys"),
+                previous if changed_rows is not None else None, changed_rows,
+            )
+        cache["master_keys"] = list(ing_dict)
+
+    perf.observe("読込: 解析・索引（取得後の全体）", (time.perf_counter() - started) * 1000, **stats)
+    # 読めなかったシートは前回の内容を引き継ぐので、前回も空だったものだけが空のまま残る
+    missing = set(previous.missing_sheets) - changed if previous is not None else set(failed)
+    return DataSnapshot(
+        previous.version + 1 if previous is not None else 1, row_cache=cache, refresh_stats=stats, missing_sheets=missing,
+        ingredient_dict=ing_dict, df_news=df_news, df_stores=df_stores, log_columns=log_columns, read_index=read_index, **derived,
+    )
+
+
+# --- 既読・意見の送信キュー ---
+def form_response_url(viewform_url):
+    # 事前入力用の .../viewform?usp=pp_url から回答送信用の .../formResponse を作る
+    return viewform_url.split("?")[0].replace("/viewform", "/formResponse")
+
+class AckQueue:
+    # 既読・意見をまずローカル（SQLite）に記録して画面へ即反映し、フォームへの送信はバックグラウンドでまとめて行う
+    # 送信に失敗したものは間隔を空けながら再送する
+    def __init__(self, db_path, targets, interval=5, batch_size=20, timeout=10):
+        # targets: 種類 → (送信先URL, {項目名: 入力欄ID})
+        self.db_path = db_path
+        self.targets = targets
+        self.interval = interval
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.last_error = None
+        self.session = requests.Session()
+        self._wake = threading.Event()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY, kind TEXT, store TEXT, title TEXT, message TEXT, "
+                "created_at REAL, sent_at REAL, attempts INTEGER DEFAULT 0, next_attempt_at REAL DEFAULT 0, last_error TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS events_store ON events (kind, store)")
+        threading.Thread(target=self._run, name="ack-flush", daemon=True).start()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def record_read(self, store, title):
+        self._record("read", store, title, "")
+
+    def record_feedback(self, store, recipe, message):
+        self._record("feedback", store, recipe, message)
+
+    def _record(self, kind, store, title, message):
+        with self._connect() as conn:
+            conn.execute("INSERT INTO events (kind, store, title, message, created_at) VALUES (?, ?, ?, ?, ?)", (kind, str(store), str(title), str(message), time.time()))
+        self._wake.set()
+
+    def read_titles(self, store):
+        # 送信済みかどうかに関係なく、この端末から既読にしたタイトル
+        with self._connect() as conn:
+            return frozenset(title for (title,) in conn.execute("SELECT title FROM events WHERE kind = 'read' AND store = ?", (str(store),)))
+
+    def pending_count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM events WHERE sent_at IS NULL").fetchone()[0]
+
+    def flush(self):
+        # 送信待ちを最大batch_size件送る。送れた件数を返す
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, kind, store, title, message, attempts FROM events WHERE sent_at IS NULL AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (now, self.batch_size),
+            ).fetchall()
+        sent = 0
+        for event_id, kind, store, title, message, attempts in rows:
+            url, fields = self.targets[kind]
+            values = {"store": store, "title": title, "message": message}
+            try:
+                res = self.session.post(url, data={entry: values[name] for name, entry in fields.items() if entry}, timeout=self.timeout)
+                res.raise_for_status()
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                with self._connect() as conn:
+                    conn.execute(
+                        "UPDATE events SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                        (attempts + 1, time.time() + min(300, 5 * 2 ** attempts), self.last_error, event_id),
+                    )
+                continue
+            with self._connect() as conn:
+                conn.execute("UPDATE events SET sent_at = ?, last_error = NULL WHERE id = ?", (time.time(), event_id))
+            self.last_error = None
+            sent += 1
+        # 送信済みで1週間たったもの（確認ログ側に反映済み）は消す
+        with self._connect() as conn:
+            conn.execute("DELETE FROM events WHERE sent_at IS NOT NULL AND sent_at < ?", (now - 7 * 24 * 3600,))
+        return sent
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                while self.flush() == self.batch_size: pass
+            except Exception as e: self.last_error = f"{type(e).__name__}: {e}"
+
+
+# --- 画像のサイズ別キャッシュ ---
+class LRUCache:
+    # 件数または合計サイズに上限のあるLRU（スレッド間で共有してよい）。ヒット/ミスの回数も数える
+    def __init__(self, max_items=None, max_bytes=None, sizeof=len):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = self.sizeof(value) if self.max_bytes else 0
+        with self._lock:
+            if key in self._items: self._bytes -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self._bytes += size
+            while len(self._items) > 1 and ((self.max_items and len(self._items) > self.max_items) or (self.max_bytes and self._bytes > self.max_bytes)):
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._bytes -= evicted
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"件数": len(self._items), "サイズ(MB)": round(self._bytes / 1024 / 1024, 1), "ヒット": self.hits, "ミス": self.misses,
+                    "ヒット率": f"{self.hits / total:.0%}" if total else "-"}
+
+
+class QueryResultCache(LRUCache):
+    # 検索結果（スコア順の行番号）の共有キャッシュ。キーにスナップショットの版を含めるので、版の切り替えで消さずにLRUの追い出しに任せる
+    # （更新直後は古い版と新しい版のセッションが混在するため、切り替えのたびに消すとヒットしなくなる）
+    def __init__(self, max_items=512):
+        super().__init__(max_items=max_items)
+
+
+class ImageCache:
+    # 画像をカード用・詳細用・印刷用の大きさに縮小して保存しておく（ファイル名は元画像の内容ハッシュ）
+    # 印刷HTMLに埋め込むBase64文字列は、合計サイズに上限のあるLRUで保持する
+    # 縮小版のファイルも合計サイズが上限を超えたら最後に使われたのが古いものから消す（Driveミラーから消えた画像の縮小版もここで消える）
+    VARIANTS = {"card": 480, "modal": 1200, "print": 800}
+    FORMAT = "r2"  # 縮小版の作り方を変えたら上げる（向きを直す前に作った縮小版を使わないように）
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, max_data_uri_bytes=32 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._digests = {}  # (パス, 更新時刻, サイズ) → 内容ハッシュ
+        self._data_uris = LRUCache(max_bytes=max_data_uri_bytes)
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-prefetch")
+        self._lock = threading.Lock()
+        self._files = {}  # ファイル名 → [サイズ, 最終利用時刻]
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if not name.endswith(".tmp"):
+                stat = os.stat(os.path.join(directory, name))
+                self._files[name] = [stat.st_size, stat.st_mtime]
+
+    def _digest(self, path):
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        digest = self._digests.get(key)
+        if digest is None:
+            with open(path, "rb") as f: digest = hashlib.sha1(f.read()).hexdigest()
+            self._digests[key] = digest
+        return digest
+
+    def variant(self, path, variant):
+        # 縮小版のパスを返す（作れなければ元の画像のパス）
+        try:
+            digest = self._digest(path)
+            for ext in (".jpg", ".png"):
+                name = f"{digest}_{variant}_{self.FORMAT}{ext}"
+                cached = os.path.join(self.directory, name)
+                if os.path.exists(cached):
+                    with self._lock: self._files.setdefault(name, [os.path.getsize(cached), 0])[1] = time.time()
+                    return cached
+
+            with Image.open(path) as img:
+                # スマートフォンの写真はEXIFの向き情報のまま保存されているので、縮小前に正しい向きへ回す
+                img = ImageOps.exif_transpose(img)
+                img.thumbnail((self.VARIANTS[variant], self.VARIANTS[variant]))
+                has_alpha = img.mode in ("RGBA", "LA", "P")
+                cached = os.path.join(self.directory, f"{digest}_{variant}_{self.FORMAT}{'.png' if has_alpha else '.jpg'}")
+                tmp = f"{cached}.{threading.get_ident()}.tmp"
+                if has_alpha: img.save(tmp, format="PNG", optimize=True)
+                else: img.convert("RGB").save(tmp, format="JPEG", quality=82, optimize=True)
+            os.replace(tmp, cached)
+            with self._lock: self._files[os.path.basename(cached)] = [os.path.getsize(cached), time.time()]
+            self._evict(keep=os.path.basename(cached))
+            return cached
+        except Exception:
+            return path
+
+    def _evict(self, keep=None):
+        # keep: 今作ったばかりで、呼び出し元がこれから使うファイル
+        with self._lock:
+            total = sum(size for size, _ in self._files.values())
+            for name, (size, _) in sorted(self._files.items(), key=lambda item: item[1][1]):
+                if total <= self.max_bytes: break
+                if name == keep: continue
+                try: os.remove(os.path.join(self.directory, name))
+                except OSError: pass
+                del self._files[name]
+                total -= size
+
+    def data_uri(self, path, variant="print"):
+        cached = self.variant(path, variant)
+        key = (cached, os.path.getmtime(cached))
+        uri = self._data_uris.get(key)
+        if uri is not None: return uri
+
+        with open(cached, "rb") as f: b64_string = base64.b64encode(f.read()).decode()
+        mime = "image/png" if cached.endswith(".png") else "image/jpeg"
+        return self._data_uris.put(key, f"data:{mime};base64,{b64_string}")
+
+    def stats(self):
+        # 埋め込み用Base64文字列のLRUの状況
+        return self._data_uris.stats()
+
+    def disk_status(self):
+        with self._lock:
+            return {"件数": len(self._files), "サイズ(MB)": round(sum(size for size, _ in self._files.values()) / 1024 / 1024, 1)}
+
+    def prefetch(self, path, variant):
+        # 縮小版をバックグラウンドで先に作っておく（失敗しても表示するときに作り直すだけ）
+        def run():
+            try: self.variant(path, variant)
+            except Exception: pass
+        self._executor.submit(run)
+
+
+# --- Google Drive上の画像・動画のミラー ---
+class DriveMirror:
+    # レシピが参照するDriveの画像・動画をバックグラウンドで並列に取得してローカルに置く
+    # 各端末はDriveではなくこのサーバーのコピー（画像はImageCacheで縮小したもの）を表示する
+    # 合計サイズが上限を超えたら、最後に使われたのが古いものから消す
+    def __init__(self, directory, hosts=("drive.google.com",), max_bytes=1024 * 1024 * 1024, max_file_bytes=200 * 1024 * 1024, workers=4, timeout=30):
+        self.directory = directory
+        self.hosts = hosts
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.timeout = timeout
+        self.last_error = None
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="drive-mirror")
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._failed = {}  # URL → 次に再試行してよい時刻
+        self._synced_version = None
+        self._files = {}   # URLのハッシュ → [ファイル名, サイズ, 最終利用時刻]
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if not name.endswith(".tmp"):
+                stat = os.stat(os.path.join(directory, name))
+                self._files[os.path.splitext(name)[0]] = [name, stat.st_size, stat.st_mtime]
+
+    def handles(self, url):
+        url = str(url)
+        return url.startswith("http") and any(host in url for host in self.hosts)
+
+    def _key(self, url):
+        return hashlib.sha1(str(url).encode()).hexdigest()
+
+    def local_path(self, url):
+        # ミラー済みならローカルのパス、まだなら取得を予約してNone
+        if not self.handles(url): return None
+        entry = self._files.get(self._key(url))
+        if entry is None:
+            self.request([url])
+            return None
+        entry[2] = time.time()
+        return os.path.join(self.directory, entry[0])
+
+    def sync(self, snapshot):
+        # スナップショットが変わったら、参照されている画像・動画をまとめて取得予約する
+        if self._synced_version == (id(snapshot), snapshot.version): return
+        self._synced_version = (id(snapshot), snapshot.version)
+        urls = []
+        for col in ["image", "video"]:
+            if col in snapshot.df.columns: urls.extend(u for u in snapshot.df[col].unique() if self.handles(u))
+        self.request(u for u in urls if self._key(u) not in self._files)
+
+    def request(self, urls):
+        now = time.time()
+        with self._lock:
+            for url in urls:
+                if url in self._pending or self._failed.get(url, 0) > now: continue
+                self._pending.add(url)
+                self._executor.submit(self._download, url)
+
+    def _download(self, url):
+        tmp = None
+        try:
+            with self.session.get(url, timeout=self.timeout, stream=True) as res:
+                res.raise_for_status()
+                content_type = res.headers.get("Content-Type", "").split(";")[0].strip()
+                ext = {"image/jpeg": ".jpg", "image/png": ".png", "image/gif": ".gif", "image/webp": ".webp",
+                       "video/mp4": ".mp4", "video/quicktime": ".mov", "video/webm": ".webm"}.get(content_type)
+                if ext is None: raise ValueError(f"画像・動画ではありません ({content_type or '不明'})")
+                name = self._key(url) + ext
+                tmp = os.path.join(self.directory, f"{name}.{threading.get_ident()}.tmp")
+                size = 0
+                with open(tmp, "wb") as f:
+                    for chunk in res.iter_content(64 * 1024):
+                        size += len(chunk)
+                        if size > self.max_file_bytes: raise ValueError("ファイルが大きすぎます")
+                        f.write(chunk)
+            os.replace(tmp, os.path.join(self.directory, name))
+            with self._lock: self._files[self._key(url)] = [name, size, time.time()]
+            self._evict()
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            with self._lock: self._failed[url] = time.time() + 600
+            if tmp and os.path.exists(tmp): os.remove(tmp)
+        finally:
+            with self._lock: self._pending.discard(url)
+
+    def _evict(self):
+        with self._lock:
+            total = sum(size for _, size, _ in self._files.values())
+            for key, (name, size, _) in sorted(self._files.items(), key=lambda item: item[1][2]):
+                if total <= self.max_bytes: break
+                try: os.remove(os.path.join(self.directory, name))
+                except OSError: pass
+                del self._files[key]
+                total -= size
+
+    def status(self):
+        with self._lock:
+            return {"件数": len(self._files), "サイズ(MB)": round(sum(size for _, size, _ in self._files.values()) / 1024 / 1024, 1), "取得待ち": len(self._pending)}
+
+
+# --- 印刷用HTML生成関数 ---
+PRINT_STYLE = """
+        <style>
+            body { font-family: sans-serif; padding: 20px; color: #000; }
+            .header-table { width: 100%; border-collapse: collapse; margin-bottom: 10px; }
+            .header-table th, .header-table td { border: 2px solid #000; padding: 8px; text-align: center; }
+            .header-table th { background-color: #eee; font-weight: bold; width: 15%; }
+            .title { font-size: 24px; font-weight: bold; text-align: center; }
+            .main-container { display: flex; gap: 10px; border: 2px solid #000; }
+            .left-col { flex: 1; padding: 10px; border-right: 2px solid #000; text-align: center; }
+            .right-col { flex: 1; display: flex; flex-direction: column; }
+            .info-row { border-bottom: 2px solid #000; padding: 5px; min-height: 50px; }
+            .info-row:last-child { border-bottom: none; }
+            .info-label { font-weight: bold; display: block; margin-bottom: 5px; font-size: 0.9em; }
+            .ing-table { width: 100%; border-collapse: collapse; margin-top: 10px; font-size: 0.9em; }
+            .ing-table th, .ing-table td { border: 1px solid #000; padding: 6px; }
+            .ing-table th { background-color: #eee; text-align: center; }
+            .steps-box { border: 2px solid #000; border-top: none; padding: 15px; }
+            .recipe-page { break-after: page; page-break-after: always; }
+            .recipe-page:last-child { break-after: auto; page-break-after: auto; }
+            @media print { body { padding: 0; } }
+        </style>"""
+
+def print_html_head(title):
+    return f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="UTF-8">
+        <title>{title}</title>{PRINT_STYLE}
+    </head>
+    <body>"""
+
+PRINT_HTML_TAIL = """
+        <script>window.onload=function(){window.print();}</script>
+    </body>
+    </html>
+    """
+
+def generate_print_body(row, ing_df, img_src=""):
+    # 1レシピ分の本文（見出し表・画像・食器・食材表・手順）
+    # img_src: 埋め込む画像（data URIかURL。呼び出し側で用意する）
+    ing_rows = "".join(
+        f"<tr><td>{name}</td><td>{amount}</td><td>{note}</td></tr>"
+        for name, amount, note in zip(ing_df["食材"], ing_df["使用量"], ing_df["備考"])
+    )
+
+    steps_html = str(row["steps"]).replace("\n", "<br>")
+    tableware_html = str(row["tableware"]).replace("\n", "<br>")
+    cutlery_html = str(row["cutlery"]).replace("\n", "<br>")
+    caution_html = str(row["caution"]).replace("\n", "<br>")
+    
+    return f"""
+        <table class="header-table">
+            <tr>
+                <td class="title" colspan="4">{row['title']}</td>
+                <th>調理時間</th>
+                <td>{row['time']}</td>
+            </tr>
+        </table>
+        <div class="main-container">
+            <div class="left-col">
+                <img src="{img_src}" style="max-width:100%; max-height:300px; object-fit:contain;">
+            </div>
+            <div class="right-col">
+                <div class="info-row"><span class="info-label">使用食器</span>{tableware_html}</div>
+                <div class="info-row"><span class="info-label">カトラリー/コンディメント</span>{cutlery_html}</div>
+                <div class="info-row" style="flex:1;"><span class="info-label">詳細・注意事項</span><span style="color:red;">{caution_html}</span></div>
+            </div>
+        </div>
+        <table class="ing-table">
+            <thead><tr><th>食材</th><th>使用量</th><th>備考</th></tr></thead>
+            <tbody>{ing_rows}</tbody>
+        </table>
+        <div class="steps-box"><b>手順：</b><br>{steps_html}</div>"""
+
+def generate_print_html(row, ing_df, img_src=""):
+    # 1レシピ分の印刷用HTML文書（開くと印刷ダイアログが出る）
+    return print_html_head(row['title']) + generate_print_body(row, ing_df, img_src) + PRINT_HTML_TAIL